@@ -1,54 +1,226 @@
 import gradio as gr
 import os
 import logging
+import importlib
+import mimetypes
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Tuple, Optional
-from src.main_workflow import omnimed_app
+from types import ModuleType
+from typing import Any, Dict, List, Tuple, Optional
 from src.core.config_manager import config
+from src.core.logging_config import configure_logging
 
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Dynamic Pathing
 BASE_DIR = Path(__file__).resolve().parent
 DEFAULT_AUDIO_PATH = BASE_DIR / "data" / "voice_alerts" / "sample.wav"
 
+# Keep Gradio's file cache on the same filesystem as data/voice_alerts so the
+# copy it makes of every returned WAV stays an in-kernel same-device copy
+# instead of a cross-device read+write through /tmp.
+os.environ.setdefault("GRADIO_TEMP_DIR", str(BASE_DIR / "data" / "gradio_cache"))
+
+# Queue Tuning: every GPU-bound event shares one concurrency group so that
+# two doctors can never stack an 8B LLM and VoxCPM on the same 16GB card.
+GPU_CONCURRENCY_ID = "llm_gpu"
+GPU_CONCURRENCY_LIMIT = int(os.getenv("OMNIMED_GPU_CONCURRENCY", "1"))
+QUEUE_MAX_SIZE = int(os.getenv("OMNIMED_QUEUE_MAX_SIZE", "32"))
+MAX_BATCH_SIZE = int(os.getenv("OMNIMED_MAX_BATCH_SIZE", "4"))
+
+# Upload Pre-flight: reject what OCR cannot handle before it reaches the queue
+MAX_UPLOAD_MB = int(os.getenv("OMNIMED_MAX_UPLOAD_MB", "25"))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+# Formats Docling can convert; a bare image/* check would also admit svg/gif/ico
+ALLOWED_MIME_TYPES = {
+    "application/pdf",
+    "image/png",
+    "image/jpeg",
+    "image/tiff",
+    "image/bmp",
+    "image/webp",
+}
+
+
+# =====================================================================
+# LAZY WORKFLOW LOADING
+# =====================================================================
+_WORKFLOW_MODULE: Optional[ModuleType] = None
+_WORKFLOW_LOCK = threading.Lock()
+
+
+def get_workflow() -> ModuleType:
+    """
+    Imports src.main_workflow (torch, Unsloth, Docling, VoxCPM) on first use.
+    Deferring it lets demo.launch() serve the UI while the heavy stack loads.
+    """
+    global _WORKFLOW_MODULE
+    if _WORKFLOW_MODULE is None:
+        with _WORKFLOW_LOCK:
+            if _WORKFLOW_MODULE is None:
+                logger.info("📦 Importing the OmniMed workflow stack...")
+                _WORKFLOW_MODULE = importlib.import_module("src.main_workflow")
+    return _WORKFLOW_MODULE
+
 
 # =====================================================================
 # STEP 1: AI ANALYSIS (Pauses at Doctor Approval)
 # =====================================================================
-def analyze_medical_case(
+def _missing_document_response() -> Tuple[str, Any, str, Any]:
+    logger.warning("User attempted to process without uploading a document.")
+    gr.Warning("No document uploaded. Please attach a medical record.")
+    return (
+        "⚠️ **Action Required:** Please upload a document.",
+        gr.update(visible=False),
+        "",
+        gr.update(),
+    )
+
+
+def _invalid_document_response(reason: str) -> Tuple[str, Any, str, Any]:
+    logger.warning(f"Rejected uploaded document: {reason}")
+    gr.Warning(reason)
+    return (
+        f"⚠️ **Action Required:** {reason}",
+        gr.update(visible=False),
+        "",
+        gr.update(),
+    )
+
+
+def _validate_document(doc_path: str) -> Optional[str]:
+    """
+    Millisecond pre-flight on the uploaded file. Returns a user-facing reason
+    when the document is unreadable, empty, too large or not an image/PDF.
+    """
+    try:
+        size = os.path.getsize(doc_path)
+    except OSError:
+        return "The uploaded document could not be read. Please upload it again."
+
+    if size == 0:
+        return "The uploaded document is empty."
+    if size > MAX_UPLOAD_BYTES:
+        return (
+            f"Document is too large ({size / (1024 * 1024):.1f} MB). "
+            f"The maximum supported size is {MAX_UPLOAD_MB} MB."
+        )
+
+    mime_type, _ = mimetypes.guess_type(doc_path)
+    if mime_type not in ALLOWED_MIME_TYPES:
+        return (
+            "Unsupported file type. Please upload a PDF or a PNG, JPEG, TIFF, "
+            "BMP or WebP image."
+        )
+
+    return None
+
+
+def _document_path(document_file: Any) -> str:
+    return document_file if isinstance(document_file, str) else document_file.name
+
+
+def _build_initial_state(
     query: str,
     patient_id: str,
     document_file: Any,
     ref_audio: Optional[str],
     ref_text: str,
     llm_model: str,
-) -> Tuple[str, Any, str, Any]:
-    """Phase 1: Runs OCR, RAG, and LLM reasoning. Pauses before Voice TTS."""
-    if document_file is None:
-        logger.warning("User attempted to process without uploading a document.")
-        gr.Warning("No document uploaded. Please attach a medical record.")
-        return (
-            "⚠️ **Action Required:** Please upload a document.",
-            gr.update(visible=False),
-            "",
-            gr.update(),
-        )
-
-    doc_path: str = (
-        document_file if isinstance(document_file, str) else document_file.name
-    )
+) -> Dict[str, Any]:
+    doc_path: str = _document_path(document_file)
 
-    state = {
+    return {
         "doctor_query": query,
         "patient_id": patient_id,
         "document_path": doc_path,
         "prompt_wav_path": ref_audio,
         "prompt_text": ref_text,
         "llm_model_id": llm_model,
+        # The UI always pauses for the Approve button before synthesizing voice
+        "interactive": True,
     }
 
+
+def _render_paused_state(
+    paused_state: Dict[str, Any], session_id: str
+) -> Tuple[str, Any, str, Any]:
+    """Maps the graph state at the HITL pause onto the four UI outputs."""
+    error_msg: Optional[str] = paused_state.get("error_message")
+    if error_msg:
+        return (
+            f"### 🚨 System Alert\n\n{error_msg}",
+            gr.update(visible=False),
+            session_id,
+            gr.update(),
+        )
+
+    report: str = paused_state.get(
+        "final_diagnosis", "Failed to generate clinical report."
+    )
+
+    logger.info(
+        f"[Session {session_id}] Workflow paused. Waiting for Doctor's approval."
+    )
+
+    # Return the report, MAKE THE APPROVE BUTTON VISIBLE, and save the session_id
+    return report, gr.update(visible=True), session_id, gr.update(value=None)
+
+
+def prefetch_uploaded_document(document_file: Any) -> None:
+    """
+    Fires on upload: starts OCR in the background while the doctor is still
+    filling in the form, so the Vision node usually finds its result ready.
+    """
+    if document_file is None:
+        return
+
+    doc_path = _document_path(document_file)
+    if _validate_document(doc_path):
+        # The submit handler reports the problem; nothing worth OCR-ing here
+        return
+
+    try:
+        ocr_tool = importlib.import_module("src.tools.ocr_vision_tool")
+        ocr_tool.prefetch_document_ocr(doc_path)
+    except Exception as e:
+        # Prefetch is best-effort; the Vision node will run OCR itself
+        logger.warning(f"⚠️ [Vision Prefetch] Skipped: {e}")
+
+
+def show_analysis_pending() -> Tuple[str, Any, Any]:
+    """Instant placeholder so the page reacts before the GPU queue is reached."""
+    return (
+        "⏳ **Analyzing document...** OCR, EHR retrieval and clinical reasoning are in progress.",
+        gr.update(visible=False),
+        gr.update(value=None),
+    )
+
+
+def analyze_medical_case(
+    query: str,
+    patient_id: str,
+    document_file: Any,
+    ref_audio: Optional[str],
+    ref_text: str,
+    llm_model: str,
+) -> Tuple[str, Any, str, Any]:
+    """Phase 1: Runs OCR, RAG, and LLM reasoning. Pauses before Voice TTS."""
+    if document_file is None:
+        return _missing_document_response()
+
+    state = _build_initial_state(
+        query, patient_id, document_file, ref_audio, ref_text, llm_model
+    )
+
+    invalid_reason = _validate_document(state["document_path"])
+    if invalid_reason:
+        return _invalid_document_response(invalid_reason)
+
     session_id = str(uuid.uuid4())
     thread_config = {"configurable": {"thread_id": session_id}}
 
@@ -56,36 +228,99 @@ def analyze_medical_case(
         logger.info(f"[Session {session_id}] Executing Phase 1 (OCR -> RAG -> LLM)...")
         gr.Info("Analyzing medical context... This may take a moment.")
 
-        paused_state = omnimed_app.invoke(state, config=thread_config)
+        paused_state = get_workflow().omnimed_app.invoke(state, config=thread_config)
 
-        error_msg: Optional[str] = paused_state.get("error_message")
-        if error_msg:
-            return (
-                f"### 🚨 System Alert\n\n{error_msg}",
-                gr.update(visible=False),
-                session_id,
-                gr.update(),
+        if not paused_state.get("error_message"):
+            gr.Info(
+                "Analysis complete! Please review the report and approve to generate Voice Alert."
             )
+        return _render_paused_state(paused_state, session_id)
 
-        report: str = paused_state.get(
-            "final_diagnosis", "Failed to generate clinical report."
+    except Exception as e:
+        logger.critical(
+            f"Catastrophic UI failure during execution: {str(e)}", exc_info=True
         )
+        raise gr.Error(f"System Failure: {str(e)}")
 
-        logger.info(
-            f"[Session {session_id}] Workflow paused. Waiting for Doctor's approval."
+
+def analyze_medical_case_batch(
+    queries: List[str],
+    patient_ids: List[str],
+    document_files: List[Any],
+    ref_audios: List[Optional[str]],
+    ref_texts: List[str],
+    llm_models: List[str],
+) -> Tuple[List[str], List[Any], List[str], List[Any]]:
+    """
+    Phase 1 (batched): Gradio groups up to MAX_BATCH_SIZE queued clicks into
+    parallel lists, which are dispatched through a single omnimed_app.batch()
+    so concurrent doctors share one scheduler pass instead of queuing serially.
+    """
+    if len(queries) == 1:
+        single = analyze_medical_case(
+            queries[0],
+            patient_ids[0],
+            document_files[0],
+            ref_audios[0],
+            ref_texts[0],
+            llm_models[0],
         )
-        gr.Info(
-            "Analysis complete! Please review the report and approve to generate Voice Alert."
+        return tuple([output] for output in single)
+
+    responses: List[Optional[Tuple[str, Any, str, Any]]] = [None] * len(queries)
+    pending: List[int] = []
+    states: List[Dict[str, Any]] = []
+    configs: List[Dict[str, Any]] = []
+
+    for i, document_file in enumerate(document_files):
+        if document_file is None:
+            responses[i] = _missing_document_response()
+            continue
+
+        state = _build_initial_state(
+            queries[i],
+            patient_ids[i],
+            document_file,
+            ref_audios[i],
+            ref_texts[i],
+            llm_models[i],
         )
 
-        # Return the report, MAKE THE APPROVE BUTTON VISIBLE, and save the session_id
-        return report, gr.update(visible=True), session_id, gr.update(value=None)
-
-    except Exception as e:
-        logger.critical(
-            f"Catastrophic UI failure during execution: {str(e)}", exc_info=True
+        invalid_reason = _validate_document(state["document_path"])
+        if invalid_reason:
+            responses[i] = _invalid_document_response(invalid_reason)
+            continue
+
+        pending.append(i)
+        states.append(state)
+        # No max_concurrency here: it would run the cases (and each case's
+        # OCR/RAG fan-out) one at a time. The LLM serializes its own GPU use
+        # and coalesces the overlapping reasoning calls into one generate().
+        configs.append({"configurable": {"thread_id": str(uuid.uuid4())}})
+
+    if states:
+        logger.info(f"[Batch] Executing Phase 1 for {len(states)} queued cases...")
+        paused_states = get_workflow().omnimed_app.batch(
+            states, config=configs, return_exceptions=True
         )
-        raise gr.Error(f"System Failure: {str(e)}")
+
+        for i, cfg, paused_state in zip(pending, configs, paused_states):
+            session_id = cfg["configurable"]["thread_id"]
+            if isinstance(paused_state, Exception):
+                logger.critical(
+                    f"[Session {session_id}] Batched execution failed: {paused_state}",
+                    exc_info=paused_state,
+                )
+                responses[i] = (
+                    f"### 🚨 System Alert\n\nSystem Failure: {paused_state}",
+                    gr.update(visible=False),
+                    "",
+                    gr.update(),
+                )
+            else:
+                responses[i] = _render_paused_state(paused_state, session_id)
+
+    return tuple(list(column) for column in zip(*responses))
 
 
 # =====================================================================
@@ -104,9 +339,13 @@ def generate_voice_alert(session_id: str) -> str:
         )
         gr.Info("Generating Voice Alert... Please wait.")
 
-        final_state = omnimed_app.invoke(None, config=thread_config)
+        workflow = get_workflow()
+        final_state = workflow.omnimed_app.invoke(None, config=thread_config)
         audio_path: Optional[str] = final_state.get("voice_alert_path", None)
 
+        # The session is complete; its checkpoints will never be resumed again
+        workflow.release_session(session_id)
+
         if audio_path and os.path.exists(audio_path):
             return audio_path
         else:
@@ -117,6 +356,72 @@ def generate_voice_alert(session_id: str) -> str:
         raise gr.Error(f"TTS Failure: {str(e)}")
 
 
+# =====================================================================
+# OPERATIONAL STATS
+# =====================================================================
+def get_embed_cache_stats() -> Dict[str, int]:
+    """Exact-hit / fuzzy-hit / miss counters of the query embedding cache."""
+    embed_cache = importlib.import_module("src.core.embed_cache")
+    return embed_cache.get_cache_stats()
+
+
+# =====================================================================
+# SERVER WARM-UP
+# =====================================================================
+def warm_up_runtime() -> None:
+    """Moves first-click cold costs (imports, CUDA context, model loads) to boot."""
+    start = time.perf_counter()
+
+    get_workflow()
+    import torch
+    from src.core.local_llm import warm_up_llm
+    from src.tools.ehr_rag_tool import get_vietnamese_vector_db
+    from src.tools.ocr_vision_tool import warm_up_document_converter
+    from src.tools.voice_tts_tool import warm_up_tts
+
+    if torch.cuda.is_available():
+        torch.cuda.init()
+        torch.zeros(1, device="cuda")
+
+    warm_steps = [
+        ("Vision OCR", warm_up_document_converter),
+        ("EHR RAG", get_vietnamese_vector_db),
+        ("Voice TTS", warm_up_tts),
+    ]
+    default_query = config.get_prompt("doctor_query")
+    if default_query:
+        # Seeds the on-disk embedding cache for the pre-filled query box
+        warm_steps.append(
+            (
+                "Default query embedding",
+                lambda: get_vietnamese_vector_db().embeddings.embed_query(
+                    default_query
+                ),
+            )
+        )
+    default_llm = config.get_models().get("default_llm")
+    if default_llm:
+        warm_steps.append(("Reasoning LLM", lambda: warm_up_llm(default_llm)))
+
+    def run_step(step_name: str, loader) -> None:
+        try:
+            loader()
+        except Exception as e:
+            logger.warning(
+                f"{step_name} warm-up failed, falling back to lazy load: {str(e)}"
+            )
+
+    # Loads are mostly disk reads and host-to-device copies, so they overlap
+    # well; each singleton's own lock serializes steps that share a model.
+    with ThreadPoolExecutor(
+        max_workers=len(warm_steps), thread_name_prefix="omnimed-warmup"
+    ) as pool:
+        for step_name, loader in warm_steps:
+            pool.submit(run_step, step_name, loader)
+
+    logger.info(f"🔥 Runtime warm-up finished in {time.perf_counter() - start:.1f}s.")
+
+
 # =====================================================================
 # GRADIO UI LAYOUT
 # =====================================================================
@@ -182,9 +487,25 @@ with gr.Blocks(title="OmniMed-Agent-OS", theme=gr.themes.Soft()) as demo:
 
             audio_output = gr.Audio(label="🔊 Voice Alert (VoxCPM)", type="filepath")
 
-    # Step 1: Run Analysis -> Output Report & Show Approve Button
+    # Step 0: Overlap OCR with form filling by starting it on upload
+    doc_input.upload(
+        fn=prefetch_uploaded_document,
+        inputs=[doc_input],
+        queue=False,
+        show_progress="hidden",
+        api_name=False,
+    )
+
+    # Step 1: Show a placeholder immediately (off-queue), then Run Analysis ->
+    # Output Report & Show Approve Button
     submit_btn.click(
-        fn=analyze_medical_case,
+        fn=show_analysis_pending,
+        outputs=[report_output, approve_btn, audio_output],
+        queue=False,
+        show_progress="hidden",
+        api_name=False,
+    ).then(
+        fn=analyze_medical_case_batch,
         inputs=[
             query_input,
             patient_id_input,
@@ -194,7 +515,12 @@ with gr.Blocks(title="OmniMed-Agent-OS", theme=gr.themes.Soft()) as demo:
             llm_model_input,
         ],
         outputs=[report_output, approve_btn, current_session_id, audio_output],
-        concurrency_limit=1,
+        batch=True,
+        max_batch_size=MAX_BATCH_SIZE,
+        show_progress="minimal",
+        api_name=False,
+        concurrency_limit=GPU_CONCURRENCY_LIMIT,
+        concurrency_id=GPU_CONCURRENCY_ID,
     )
 
     # Step 2: Click Approve -> Resume Graph -> Output Audio
@@ -202,9 +528,33 @@ with gr.Blocks(title="OmniMed-Agent-OS", theme=gr.themes.Soft()) as demo:
         fn=generate_voice_alert,
         inputs=[current_session_id],
         outputs=[audio_output],
-        concurrency_limit=1,
+        api_name=False,
+        concurrency_limit=GPU_CONCURRENCY_LIMIT,
+        concurrency_id=GPU_CONCURRENCY_ID,
     )
 
+    # Stats route (api_name "embed_cache_stats"): an in-memory counter read,
+    # so it skips the queue instead of waiting behind GPU-bound events
+    gr.api(get_embed_cache_stats, api_name="embed_cache_stats", queue=False)
+
 if __name__ == "__main__":
+    # Warm Start: import the stack and deserialize models in the background
+    # while the UI is already being served. A click that arrives first simply
+    # waits on the same import/model locks instead of loading twice.
+    threading.Thread(target=warm_up_runtime, name="omnimed-warmup", daemon=True).start()
+
     logger.info("🚀 Launching OmniMed Web Interface on local server...")
-    demo.launch(share=True, debug=True)
+    # api_open=False closes the auto-mounted REST route so requests cannot
+    # bypass the queue and its GPU concurrency limits.
+    demo.queue(
+        default_concurrency_limit=GPU_CONCURRENCY_LIMIT,
+        max_size=QUEUE_MAX_SIZE,
+        api_open=False,
+    )
+    # Local-first: no Gradio relay tunnel unless explicitly requested (e.g. Colab)
+    demo.launch(
+        share=os.getenv("OMNIMED_SHARE", "false").lower() in ("true", "1", "t"),
+        server_name=os.getenv("GRADIO_SERVER_NAME", "0.0.0.0"),
+        server_port=int(os.getenv("GRADIO_SERVER_PORT", "7860")),
+        debug=os.getenv("OMNIMED_DEBUG", "false").lower() in ("true", "1", "t"),
+    )
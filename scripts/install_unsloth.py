@@ -2,6 +2,7 @@ import os
 import re
 import subprocess
 import sys
+import tempfile
 
 # =====================================================================
 # UNSLOTH DYNAMIC INSTALLER
@@ -13,23 +14,56 @@ def run_cmd(cmd: str):
     print(f"⚙️ [Unsloth Setup] Executing: {cmd}")
     subprocess.run(cmd, shell=True, check=True)
 
+def get_installer() -> str:
+    """Prefers uv (parallel resolver + wheel extraction), falling back to pip."""
+    try:
+        run_cmd(f'"{sys.executable}" -m pip install uv -q')
+        # Run uv through the interpreter: its binary may not be on PATH
+        # (non-activated venv, --user install). --python targets the exact
+        # interpreter running this script (venv, conda or Colab).
+        return f'"{sys.executable}" -m uv pip install --python "{sys.executable}"'
+    except subprocess.CalledProcessError:
+        print("⚠️ [Unsloth Setup] uv unavailable. Falling back to pip...")
+        return f'"{sys.executable}" -m pip install'
+
+def install_requirements(pip_install: str, packages: list, no_deps: bool = False):
+    """Installs a package set in ONE resolver pass via a temporary requirements file."""
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.write("\n".join(packages) + "\n")
+        req_path = f.name
+    try:
+        flags = " --no-deps" if no_deps else ""
+        run_cmd(f'{pip_install}{flags} -r "{req_path}" -q')
+    finally:
+        os.remove(req_path)
+
 def install_unsloth():
     print("🦥 [Unsloth Setup] Initializing dynamic installation for Unsloth...")
+    pip_install = get_installer()
     
     # Check if the environment is Google Colab
     env_keys = "".join(os.environ.keys())
     is_colab = "COLAB_" in env_keys
     
+    # Force specific versions of transformers and trl to ensure compatibility.
+    # They override whatever unsloth itself pins, so they are never put in the
+    # same resolver pass as unsloth (that would fail or backtrack unsloth).
+    transformers_pin = "transformers==4.56.2"
+    trl_pin = "trl==0.22.2"
+    
     if not is_colab:
         print("💻 [Unsloth Setup] Detected Local/Standard Cloud environment.")
-        run_cmd("pip install unsloth -q")
+        run_cmd(f"{pip_install} unsloth -q")
+        print("📦 [Unsloth Setup] Forcing specific versions for transformers and trl...")
+        run_cmd(f"{pip_install} {transformers_pin} -q")
+        run_cmd(f"{pip_install} --no-deps {trl_pin} -q")
     else:
         print("☁️ [Unsloth Setup] Detected Google Colab environment. Matching Torch versions...")
         # Ensure torch is installed before checking version
         try:
             import torch
         except ImportError:
-            run_cmd("pip install torch -q")
+            run_cmd(f"{pip_install} torch -q")
             import torch
             
         # Extract base Torch version (e.g., '2.10' from '2.10.0+cu128')
@@ -42,14 +76,17 @@ def install_unsloth():
         
         print(f"🧩 [Unsloth Setup] Selected {xformers_pkg} for Torch {v}")
         
-        # Execute complex dependency installations
-        run_cmd('pip install sentencepiece protobuf "datasets<4" "huggingface_hub>=0.34.0" hf_transfer -q')
-        run_cmd(f'pip install --no-deps unsloth_zoo bitsandbytes accelerate {xformers_pkg} peft trl triton unsloth -q')
-    
-    # Force specific versions of transformers and trl to ensure compatibility
-    print("📦 [Unsloth Setup] Forcing specific versions for transformers and trl...")
-    run_cmd("pip install transformers==4.56.2 -q")
-    run_cmd("pip install --no-deps trl==0.22.2 -q")
+        # Execute complex dependency installations: one resolved pass for the
+        # shared deps, one --no-deps pass for the Torch-sensitive wheels
+        # (pip cannot mix --no-deps and resolved requirements in one call)
+        install_requirements(pip_install, [
+            "sentencepiece", "protobuf", "datasets<4", "huggingface_hub>=0.34.0",
+            "hf_transfer", transformers_pin,
+        ])
+        install_requirements(pip_install, [
+            "unsloth_zoo", "bitsandbytes", "accelerate", xformers_pkg, "peft",
+            trl_pin, "triton", "unsloth",
+        ], no_deps=True)
     
     print("✅ [Unsloth Setup] Unsloth and dependencies installed successfully!")
 
@@ -14,6 +14,12 @@ class ConfigManager:
 
     _instance = None
     _config = None
+    _config_path = None
+    _mtime = 0.0
+    _prompts = {}
+    _models = {}
+    # Dev-only hot reload: re-read the YAML when its mtime changes
+    _hot_reload = os.getenv("OMNIMED_DEBUG", "false").lower() in ("true", "1", "t")
 
     def __new__(cls):
         if cls._instance is None:
@@ -21,7 +27,7 @@ class ConfigManager:
             cls._instance._load_config()
         return cls._instance
 
-    def _load_config(self):
+    def _resolve_config_path(self) -> Path:
         # [ENTERPRISE FIX] 1. Allow using Environment Variables to override path
         env_config_path = os.getenv("OMNIMED_CONFIG_PATH")
 
@@ -45,9 +51,15 @@ class ConfigManager:
                     "CRITICAL: Could not locate 'configs/system_config.yaml' in any parent directory."
                 )
 
+        return config_path
+
+    def _load_config(self):
+        config_path = self._resolve_config_path()
+
         try:
+            mtime = config_path.stat().st_mtime
             with open(config_path, "r", encoding="utf-8") as f:
-                self._config = yaml.safe_load(f)
+                self._config = yaml.safe_load(f) or {}
             logger.info(
                 f"✅ [ConfigManager] System configuration loaded from: {config_path}"
             )
@@ -55,11 +67,30 @@ class ConfigManager:
             logger.critical(f"❌ [ConfigManager] Failed to load config file: {e}")
             raise
 
+        # Flatten the hot sections once so lookups are a single dict access
+        self._config_path = config_path
+        self._mtime = mtime
+        self._prompts = self._config.get("prompts", {}) or {}
+        self._models = self._config.get("models", {}) or {}
+
+    def maybe_reload(self):
+        """Re-parses the YAML only if the file changed since the last load."""
+        try:
+            if self._config_path.stat().st_mtime > self._mtime:
+                logger.info("🔄 [ConfigManager] Configuration changed on disk.")
+                self._load_config()
+        except OSError as e:
+            logger.warning(f"⚠️ [ConfigManager] Hot reload skipped: {e}")
+
     def get_models(self):
-        return self._config.get("models", {})
+        if self._hot_reload:
+            self.maybe_reload()
+        return self._models
 
     def get_prompt(self, prompt_name: str) -> str:
-        return self._config.get("prompts", {}).get(prompt_name, "")
+        if self._hot_reload:
+            self.maybe_reload()
+        return self._prompts.get(prompt_name, "")
 
 
 # Global instance to be imported by other modules
@@ -0,0 +1,173 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import Counter, OrderedDict
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# =====================================================================
+# CONFIGURATION
+# =====================================================================
+# Dynamic Pathing: Calculate root directory safely regardless of execution folder
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+EMBED_CACHE_DIR = BASE_DIR / "data" / "embed_cache"
+
+# Vectors are derived from doctors' queries, which may carry PHI, so the store
+# keeps only the most recently used entries instead of growing without bound.
+MAX_CACHED_EMBEDDINGS = 1024
+
+# Near-duplicate reuse is opt-in: a one-character edit can be a different
+# dose or temperature ("sốt 37.5" vs "sốt 39.5"), so by default only exact
+# repeats are served from the cache. Lower this (e.g. 0.95) to let a query
+# within that similarity ratio reuse a previously seen query's embedding.
+FUZZY_MATCH_THRESHOLD = float(os.getenv("OMNIMED_EMBED_FUZZY_THRESHOLD", "1.0"))
+FUZZY_INDEX_SIZE = 512
+
+# Raw query text may carry PHI, so the fuzzy index lives in process memory
+# only; the on-disk store holds nothing but hashed keys and vectors.
+_TEXT_INDEX: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+_INDEX_LOCK = threading.Lock()
+_STATS: Counter = Counter()
+
+
+def _cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def _remember(key: str, model_name: str, text: str) -> None:
+    with _INDEX_LOCK:
+        _TEXT_INDEX[key] = (model_name, text)
+        _TEXT_INDEX.move_to_end(key)
+        while len(_TEXT_INDEX) > FUZZY_INDEX_SIZE:
+            _TEXT_INDEX.popitem(last=False)
+
+
+def _find_near_duplicate(model_name: str, text: str) -> Optional[str]:
+    """Returns the cache key of the closest known text above the threshold."""
+    if FUZZY_MATCH_THRESHOLD >= 1.0:
+        return None
+
+    with _INDEX_LOCK:
+        candidates = list(_TEXT_INDEX.items())
+
+    best_key, best_ratio = None, FUZZY_MATCH_THRESHOLD
+    for key, (cached_model, cached_text) in reversed(candidates):
+        if cached_model != model_name:
+            continue
+        # Cheap length bound first: ratio can never exceed 2*min/(len_a+len_b)
+        if 2 * min(len(text), len(cached_text)) < best_ratio * (
+            len(text) + len(cached_text)
+        ):
+            continue
+        matcher = SequenceMatcher(None, text, cached_text, autojunk=False)
+        if matcher.quick_ratio() < best_ratio:
+            continue
+        ratio = matcher.ratio()
+        if ratio >= best_ratio:
+            best_key, best_ratio = key, ratio
+
+    return best_key
+
+
+def _load_vector(cache_path: Path) -> Optional[List[float]]:
+    # No exists() pre-check: a concurrent prune can remove the file in between
+    try:
+        vector = np.load(cache_path).tolist()
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ [Embed Cache] Discarding unreadable entry: {e}")
+        return None
+
+    try:
+        # Refresh the mtime so frequently used entries survive pruning
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return vector
+
+
+def _prune_embed_cache() -> None:
+    entries = []
+    for entry in EMBED_CACHE_DIR.glob("*.npy"):
+        try:
+            entries.append((entry.stat().st_mtime, entry))
+        except FileNotFoundError:
+            # Another session's prune got there first
+            continue
+    entries.sort()
+    for _, stale in entries[:-MAX_CACHED_EMBEDDINGS]:
+        stale.unlink(missing_ok=True)
+
+
+def get_cache_stats() -> Dict[str, int]:
+    """Exact-hit / fuzzy-hit / miss counters since process start."""
+    return {name: _STATS[name] for name in ("hit_exact", "hit_fuzzy", "miss")}
+
+
+def cached_embed(
+    text: str, model_name: str, embed_fn: Callable[[str], List[float]]
+) -> List[float]:
+    """
+    Returns the embedding of `text`, consulting a SHA-256 keyed on-disk store
+    first. The UI ships default queries that most doctors submit unchanged, so
+    a hit replaces a full bi-encoder forward pass with a single .npy read.
+    On an exact miss, a near-duplicate of a recently seen query is reused.
+    """
+    key = _cache_key(model_name, text)
+    cache_path = EMBED_CACHE_DIR / f"{key}.npy"
+
+    vector = _load_vector(cache_path)
+    if vector is not None:
+        _STATS["hit_exact"] += 1
+        _remember(key, model_name, text)
+        return vector
+
+    neighbour_key = _find_near_duplicate(model_name, text)
+    if neighbour_key is not None:
+        vector = _load_vector(EMBED_CACHE_DIR / f"{neighbour_key}.npy")
+        if vector is not None:
+            _STATS["hit_fuzzy"] += 1
+            logger.info("♻️ [Embed Cache] Reusing embedding of a near-duplicate query.")
+            return vector
+
+    _STATS["miss"] += 1
+    vector = embed_fn(text)
+    _remember(key, model_name, text)
+
+    try:
+        EMBED_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial array
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.asarray(vector, dtype=np.float32))
+        os.replace(tmp_path, cache_path)
+        _prune_embed_cache()
+    except OSError as e:
+        logger.warning(f"⚠️ [Embed Cache] Could not persist embedding: {e}")
+
+    return vector
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Drop-in Embeddings wrapper: query embeddings are served through
+    cached_embed(), document embeddings pass straight to the wrapped model.
+    """
+
+    def __init__(self, base: Embeddings, model_name: str):
+        self.base = base
+        self.model_name = model_name
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return cached_embed(text, self.model_name, self.base.embed_query)
@@ -0,0 +1,42 @@
+from typing import List
+
+import numpy as np
+from langchain_huggingface import HuggingFaceEmbeddings
+
+# =====================================================================
+# SHARED BI-ENCODER WRAPPER
+# =====================================================================
+# Used by both the ingestion script and the RAG query path, so corpus and
+# query vectors are always normalized the same way.
+
+
+class Fp32NormalizedEmbeddings(HuggingFaceEmbeddings):
+    """
+    Half-precision bi-encoder whose pooled vectors are upcast to fp32 before
+    L2 normalization, so the stored norms do not carry bf16 rounding error.
+    """
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        """Unit-norm float32 matrix, ready for chromadb without list marshaling."""
+        import torch
+
+        # Same newline folding as HuggingFaceEmbeddings, but encode() straight
+        # to an ndarray instead of round-tripping through nested lists
+        texts = [text.replace("\n", " ") for text in texts]
+        # Stricter than no_grad: also skips version-counter bumps on tensors
+        with torch.inference_mode():
+            raw = self._client.encode(
+                texts,
+                convert_to_numpy=True,
+                show_progress_bar=self.show_progress,
+                **self.encode_kwargs,
+            )
+        vectors = raw.astype(np.float32, copy=False)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
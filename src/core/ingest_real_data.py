@@ -1,13 +1,26 @@
 import os
+import sys
+import hashlib
 import logging
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Set
+
 import pandas as pd
 from tqdm import tqdm
-from datasets import load_dataset, concatenate_datasets
+from datasets import load_dataset, load_from_disk, concatenate_datasets
 from langchain_core.documents import Document
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from dotenv import load_dotenv
 
+if __name__ == "__main__":
+    # Direct runs (python src/core/ingest_real_data.py) put src/core, not the
+    # repo root, on sys.path; add the root so src.* imports resolve
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from src.core.embeddings import Fp32NormalizedEmbeddings
+
 # =====================================================================
 # ENTERPRISE LOGGING CONFIGURATION
 # =====================================================================
@@ -27,13 +40,60 @@ load_dotenv()
 # Langchain may throw a minor warning, but since we rely entirely on local
 # HuggingFace embeddings for privacy, external API keys are strictly unnecessary.
 
+EMBEDDING_MODEL_NAME = "bkai-foundation-models/vietnamese-bi-encoder"
+
+# Records parsed, embedded and written per step; bounds RAM/VRAM during ingest
+BATCH_SIZE = 1000
+# Sequences per encoder forward pass. Short QA pairs under-fill the GPU at
+# the sentence-transformers default of 32; 256 still fits a 16GB T4 in fp16.
+EMBED_BATCH_SIZE = int(os.getenv("OMNIMED_EMBED_BATCH_SIZE", "256"))
+# Opt-in torch.compile of the encoder: pays a one-off compile for fused
+# kernels, which only amortizes over a full-corpus ingest
+COMPILE_EMBEDDER = os.getenv("OMNIMED_COMPILE_EMBEDDER", "false").lower() in (
+    "true",
+    "1",
+    "t",
+)
+
+# HNSW build settings, applied when the collection is first created. The
+# large batch/sync thresholds let Chroma buffer inserts and flush the index
+# to disk a few times per ingest instead of after every chunk. Vectors are
+# unit-norm, so cosine ranks exactly like L2 but gives thresholdable scores.
+HNSW_COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 200,
+    "hnsw:M": 32,
+    "hnsw:batch_size": 10000,
+    "hnsw:sync_threshold": 50000,
+}
+
+# Optional ONNX Runtime encoder (OMNIMED_EMBED_BACKEND=onnx). Needs
+# onnxruntime-gpu + optimum; the export is cached so it only happens once.
+EMBED_BACKEND = os.getenv("OMNIMED_EMBED_BACKEND", "torch").lower()
+ONNX_EXPORT_DIR = "./data/vietnamese_med_corpus/onnx"
+
+# Process-level singleton: repeated ingests in one session reuse the encoder
+_EMBEDDINGS_CACHE = None
+
 # =====================================================================
 # REAL DATA INGESTION PIPELINE (Vietnamese Medical Corpus)
 # =====================================================================
 
 
+def _arrow_dir(data_path: str) -> str:
+    return os.path.splitext(data_path)[0] + "_arrow"
+
+
+def has_local_corpus(data_path: str) -> bool:
+    """True if either supported on-disk copy (Arrow or CSV) exists."""
+    return any(os.path.exists(path) for path in (_arrow_dir(data_path), data_path))
+
+
 def download_and_prepare_data(data_path: str):
-    """Downloads the ViHealthQA dataset from HuggingFace and saves it locally."""
+    """
+    Downloads the ViHealthQA dataset from HuggingFace and saves it locally in
+    Arrow format, skipping the CSV round-trip (no dtype or Unicode reparsing).
+    """
     logger.info(
         "⏳ [Data Ingestion] Downloading RAG Medical Text data (ViHealthQA) from HuggingFace..."
     )
@@ -42,15 +102,18 @@ def download_and_prepare_data(data_path: str):
     os.makedirs(os.path.dirname(data_path), exist_ok=True)
 
     try:
-        # Download dataset and save as a CSV file (Bronze Layer)
-        ds_dict = load_dataset("tarudesu/ViHealthQA")
+        # Download the dataset, decoding its split shards in parallel (Bronze Layer)
+        ds_dict = load_dataset(
+            "tarudesu/ViHealthQA", num_proc=min(8, os.cpu_count() or 1)
+        )
         all_splits = [ds_dict[split] for split in ds_dict.keys()]
         ds_combined = concatenate_datasets(all_splits)
-        df = ds_combined.to_pandas()
 
-        df.to_csv(data_path, index=False, encoding="utf-8")
-        logger.info(f"✅ [Data Ingestion] Data saved successfully to {data_path}")
-        return data_path
+        # Persist it as memory-mappable Arrow
+        arrow_dir = _arrow_dir(data_path)
+        ds_combined.save_to_disk(arrow_dir)
+        logger.info(f"✅ [Data Ingestion] Data saved successfully to {arrow_dir}")
+        return arrow_dir
     except Exception as e:
         logger.critical(
             f"❌ [Data Ingestion] Failed to download dataset.", exc_info=True
@@ -58,77 +121,298 @@ def download_and_prepare_data(data_path: str):
         raise
 
 
-if __name__ == "__main__":
-    logger.info("🚀 Starting local RAG ingestion pipeline...")
+def _resolve_column(columns: pd.Index, primary: str, fallback: str) -> str:
+    """ViHealthQA exports use question/answer; instruction-style dumps do not."""
+    return primary if primary in columns else fallback
 
-    # Define local path for CSV database
-    data_filepath = "./data/vietnamese_med_corpus/vihealthqa_data.csv"
 
-    # 1. Download data if it doesn't exist locally
-    if not os.path.exists(data_filepath):
-        download_and_prepare_data(data_filepath)
-    else:
-        logger.info(
-            f"⏭️ [Data Ingestion] Local dataset found at {data_filepath}. Skipping download."
+def _with_row_numbers(chunks: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """Re-indexes per-batch frames so each row keeps its corpus-wide position."""
+    offset = 0
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+
+
+def convert_csv_to_arrow(data_path: str) -> Optional[str]:
+    """
+    One-off conversion of a CSV corpus from older installs into the Arrow
+    dataset directory, so later ingests memory-map it instead of reparsing.
+    Returns None (the caller keeps reading the CSV) if the conversion fails.
+    """
+    arrow_dir = _arrow_dir(data_path)
+    logger.info(f"🔄 [Data Ingestion] Converting {data_path} to Arrow (one-off)...")
+    try:
+        dataset = load_dataset("csv", data_files=data_path, split="train")
+        # Save under a temp name and rename, so an interrupted conversion is
+        # never mistaken for a complete Arrow copy on the next run
+        tmp_dir = f"{arrow_dir}.{os.getpid()}.tmp"
+        dataset.save_to_disk(tmp_dir)
+        os.replace(tmp_dir, arrow_dir)
+    except Exception as e:
+        logger.warning(f"⚠️ [Data Ingestion] Arrow conversion failed, reading CSV: {e}")
+        return None
+    logger.info(f"✅ [Data Ingestion] Arrow copy saved to {arrow_dir}")
+    return arrow_dir
+
+
+def iter_corpus_chunks(data_path: str, batch_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Yields the QA columns of the corpus one batch at a time from the Arrow
+    dataset, converting an existing CSV to Arrow on first read.
+    Chunks carry the original row numbers as their index so record_id is
+    identical whichever copy is read.
+    """
+    arrow_dir = _arrow_dir(data_path)
+    if not os.path.exists(arrow_dir) and os.path.exists(data_path):
+        arrow_dir = convert_csv_to_arrow(data_path)
+
+    if arrow_dir:
+        logger.info(f"⚡ [Data Ingestion] Memory-mapping Arrow dataset {arrow_dir}...")
+        dataset = load_from_disk(arrow_dir)
+        names = pd.Index(dataset.column_names)
+        columns = [
+            _resolve_column(names, "question", "instruction"),
+            _resolve_column(names, "answer", "output"),
+        ]
+        yield from _with_row_numbers(
+            dataset.select_columns(columns).to_pandas(
+                batch_size=batch_size, batched=True
+            )
         )
+        return
+
+    header = pd.read_csv(data_path, nrows=0).columns
+    columns = [
+        _resolve_column(header, "question", "instruction"),
+        _resolve_column(header, "answer", "output"),
+    ]
+    yield from pd.read_csv(data_path, chunksize=batch_size, usecols=columns)
+
+
+def build_documents(df: pd.DataFrame) -> List[Document]:
+    """
+    Converts QA rows into Langchain Documents with whole-column operations
+    instead of a per-row iterrows() loop. Rows missing either side are dropped.
+    """
+    qcol = _resolve_column(df.columns, "question", "instruction")
+    acol = _resolve_column(df.columns, "answer", "output")
+
+    # Skip empty rows to maintain data integrity
+    df = df.dropna(subset=[qcol, acol])
+
+    contents = (
+        "Question/Symptom: "
+        + df[qcol].astype(str)
+        + "\nAnalysis/Answer: "
+        + df[acol].astype(str)
+    ).tolist()
+    record_ids = df.index.astype(str).tolist()
+
+    return [
+        Document(
+            page_content=content,
+            metadata={"source": "ViHealthQA", "record_id": record_id},
+        )
+        for content, record_id in zip(contents, record_ids)
+    ]
+
+
+def drop_duplicate_documents(docs: List[Document], seen: Set[bytes]) -> List[Document]:
+    """
+    Keeps the first occurrence of each page_content across the whole ingest.
+    The merged train/val/test splits repeat QA pairs, and embedding them again
+    only inflates the HNSW graph. `seen` holds 16-byte digests, not the text.
+    """
+    unique = []
+    for doc in docs:
+        digest = hashlib.blake2b(
+            doc.page_content.encode("utf-8"), digest_size=16
+        ).digest()
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(doc)
+    return unique
 
-    # 2. Read the CSV data
-    logger.info("📖 [Data Ingestion] Loading dataset into memory...")
-    df = pd.read_csv(data_filepath)
 
-    # 3. Initialize Local Embedding Model
+def iter_document_batches(chunks: Iterator[pd.DataFrame]) -> Iterator[List[Document]]:
+    """
+    Reads and parses the next chunk on a worker thread while the caller embeds
+    the current one, so disk I/O and Document construction overlap the GPU.
+    """
+
+    def parse_next() -> Optional[List[Document]]:
+        chunk = next(chunks, None)
+        return None if chunk is None else build_documents(chunk)
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-parse") as pool:
+        pending = pool.submit(parse_next)
+        while True:
+            batch = pending.result()
+            if batch is None:
+                return
+            pending = pool.submit(parse_next)
+            yield batch
+
+
+def _load_onnx_embeddings() -> Fp32NormalizedEmbeddings:
+    """Runs the bi-encoder on ONNX Runtime's CUDA provider (fused kernels)."""
+    exported = os.path.isdir(ONNX_EXPORT_DIR)
     logger.info(
-        "🧠 [Data Ingestion] Loading embedding model (bkai-foundation-models/vietnamese-bi-encoder)..."
+        f"🧠 [Data Ingestion] Loading embedding model ({EMBEDDING_MODEL_NAME}, ONNX Runtime)..."
     )
-    embeddings = HuggingFaceEmbeddings(
-        model_name="bkai-foundation-models/vietnamese-bi-encoder",
-        model_kwargs={"device": "cuda"},
-        encode_kwargs={"normalize_embeddings": True},
+    embeddings = Fp32NormalizedEmbeddings(
+        model_name=ONNX_EXPORT_DIR if exported else EMBEDDING_MODEL_NAME,
+        model_kwargs={
+            "device": "cuda",
+            "backend": "onnx",
+            "model_kwargs": {"provider": "CUDAExecutionProvider"},
+        },
+        encode_kwargs={
+            "normalize_embeddings": False,
+            "batch_size": EMBED_BATCH_SIZE,
+        },
     )
+    if not exported:
+        logger.info(f"💾 [Data Ingestion] Caching ONNX export at {ONNX_EXPORT_DIR}...")
+        embeddings._client.save_pretrained(ONNX_EXPORT_DIR)
+    return embeddings
 
-    # 4. Process dataframe into Langchain Document objects
-    logger.info(
-        "🔄 [Data Ingestion] Converting records to Langchain Document format..."
-    )
-    docs = []
-    for index, row in df.iterrows():
-        question = row.get("question", row.get("instruction", ""))
-        answer = row.get("answer", row.get("output", ""))
-
-        # Skip empty rows to maintain data integrity
-        if pd.isna(question) or pd.isna(answer):
-            continue
-
-        content = f"Question/Symptom: {question}\nAnalysis/Answer: {answer}"
-        docs.append(
-            Document(
-                page_content=content,
-                metadata={"source": "ViHealthQA", "record_id": str(index)},
-            )
+
+def load_embeddings() -> Fp32NormalizedEmbeddings:
+    """
+    Loads the bi-encoder in bfloat16 (float16 on pre-Ampere GPUs such as the
+    T4) so its matmuls run on Tensor Cores and the weights take half the VRAM.
+    """
+    if EMBED_BACKEND == "onnx":
+        if all(importlib.util.find_spec(pkg) for pkg in ("onnxruntime", "optimum")):
+            return _load_onnx_embeddings()
+        logger.warning(
+            "⚠️ [Data Ingestion] onnxruntime-gpu/optimum not installed. Falling back to PyTorch."
         )
 
+    import torch  # Only needed once we actually embed
+
+    # Let any residual fp32 matmuls use TF32 Tensor Core paths on Ampere+
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.set_float32_matmul_precision("high")
+
+    dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
     logger.info(
-        f"💾 [Data Ingestion] Initializing ChromaDB connection for {len(docs)} records..."
+        f"🧠 [Data Ingestion] Loading embedding model ({EMBEDDING_MODEL_NAME}, {dtype})..."
     )
+    embeddings = Fp32NormalizedEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        model_kwargs={"device": "cuda", "model_kwargs": {"torch_dtype": dtype}},
+        encode_kwargs={
+            "normalize_embeddings": False,
+            "batch_size": EMBED_BATCH_SIZE,
+        },
+    )
+
+    if COMPILE_EMBEDDER:
+        logger.info("⚙️ [Data Ingestion] Compiling the encoder with torch.compile...")
+        # Sequence lengths vary per batch, so compile for dynamic shapes rather
+        # than capturing one CUDA graph per length (mode="reduce-overhead")
+        transformer = embeddings._client[0]
+        transformer.auto_model = torch.compile(transformer.auto_model, dynamic=True)
+
+    return embeddings
+
+
+def get_embeddings() -> Fp32NormalizedEmbeddings:
+    """Loads the encoder on first use and keeps it warm for later calls."""
+    global _EMBEDDINGS_CACHE
+
+    if _EMBEDDINGS_CACHE is None:
+        _EMBEDDINGS_CACHE = load_embeddings()
+    else:
+        logger.info("♻️ [Data Ingestion] Reusing the already loaded embedding model.")
+
+    return _EMBEDDINGS_CACHE
+
 
-    # 5. Initialize ChromaDB connection
+def _embed_and_add(
+    collection, embeddings: Fp32NormalizedEmbeddings, batch: List[Document]
+) -> None:
+    """
+    Embeds one chunk explicitly and inserts the precomputed vectors with the
+    native collection.add() instead of re-wrapping via Chroma.add_documents().
+    Ids derive from record_id, so re-running the ingest does not duplicate rows.
+    """
+    texts = [doc.page_content for doc in batch]
+    collection.add(
+        ids=[f"vihealthqa-{doc.metadata['record_id']}" for doc in batch],
+        embeddings=embeddings.embed_array(texts),
+        documents=texts,
+        metadatas=[doc.metadata for doc in batch],
+    )
+
+
+def ingest_real_vietnamese_medical_data(
+    data_filepath: str, batch_size: int = BATCH_SIZE
+) -> None:
+    """
+    Embeds the local ViHealthQA corpus into the persistent ChromaDB store.
+    The corpus is streamed chunk by chunk, so peak memory is one batch of
+    Documents rather than the whole corpus.
+    """
+    # 1. Download data if it doesn't exist locally
+    if not has_local_corpus(data_filepath):
+        download_and_prepare_data(data_filepath)
+    else:
+        logger.info(
+            f"⏭️ [Data Ingestion] Local dataset found for {data_filepath}. Skipping download."
+        )
+
+    # 2. Initialize Local Embedding Model
+    embeddings = get_embeddings()
+
+    # 3. Initialize ChromaDB connection
+    logger.info("💾 [Data Ingestion] Initializing ChromaDB connection...")
     db = Chroma(
         embedding_function=embeddings,
         persist_directory="./data/vietnamese_med_corpus/chroma_db",
         collection_name="vietnamese_ehr_records",
+        collection_metadata=HNSW_COLLECTION_METADATA,
     )
 
-    # 6. Execute Batching to prevent RAM/VRAM overflow during embeddings
-    BATCH_SIZE = 1000
+    # 4. Stream the corpus: parse only the QA columns, one batch at a time
+    reader = iter_corpus_chunks(data_filepath, batch_size)
+
     logger.info(
-        f"⏳ [Data Ingestion] Starting batch embedding process (Batch size: {BATCH_SIZE})..."
+        f"⏳ [Data Ingestion] Starting streamed embedding process (Batch size: {batch_size})..."
     )
-    logger.info(f"☕ This will take some time for {len(docs)} records. Please wait...")
+    logger.info("☕ This will take some time for the full corpus. Please wait...")
+
+    # 5. Convert and embed each chunk as soon as it is read (the chunk index
+    # continues across chunks, so record_id stays the original row number).
+    # No length pre-sort is needed: SentenceTransformer.encode() already
+    # orders each chunk by text length before forming padded batches.
+    total_docs = 0
+    duplicates = 0
+    seen_digests: Set[bytes] = set()
+    for batch in tqdm(iter_document_batches(reader), desc="Vectorizing Batches"):
+        unique = drop_duplicate_documents(batch, seen_digests)
+        duplicates += len(batch) - len(unique)
+        if unique:
+            _embed_and_add(db._collection, embeddings, unique)
+            total_docs += len(unique)
 
-    for i in tqdm(range(0, len(docs), BATCH_SIZE), desc="Vectorizing Batches"):
-        batch = docs[i : i + BATCH_SIZE]
-        db.add_documents(documents=batch)
+    if duplicates:
+        logger.info(f"🧹 [Data Ingestion] Skipped {duplicates} duplicate records.")
 
     logger.info(
-        "✅ [Data Ingestion] Full dataset ingestion complete! ChromaDB is permanently saved and ready for semantic search."
+        f"✅ [Data Ingestion] Full dataset ingestion complete ({total_docs} records)! ChromaDB is permanently saved and ready for semantic search."
+    )
+
+
+if __name__ == "__main__":
+    logger.info("🚀 Starting local RAG ingestion pipeline...")
+
+    # Base path of the local corpus; the Arrow copy is saved alongside it and
+    # a CSV at this path is converted to Arrow on first read
+    ingest_real_vietnamese_medical_data(
+        "./data/vietnamese_med_corpus/vihealthqa_data.csv"
     )
@@ -0,0 +1,91 @@
+import os
+import time
+import logging
+import threading
+import functools
+from collections import OrderedDict
+from typing import Any, Tuple
+
+import torch
+from src.core.vram_manager import register_evictor
+
+logger = logging.getLogger(__name__)
+
+# =====================================================================
+# CONFIGURATION
+# =====================================================================
+MAX_SEQ_LENGTH = 2048
+DTYPE = None  # Auto-detect (bfloat16 for Ampere+, float16 for Tesla T4)
+LOAD_IN_4BIT = True
+
+# How many distinct checkpoints may stay resident at once. One 4-bit 8B model
+# already takes ~6GB, so the default leaves room for OCR, RAG and TTS on 16GB.
+LLM_CACHE_SIZE = max(1, int(os.getenv("OMNIMED_LLM_CACHE_SIZE", "1")))
+
+# =====================================================================
+# PROCESS-LEVEL WARM MODEL CACHE
+# =====================================================================
+_LLM_CACHE: "OrderedDict[str, Tuple[Any, Any]]" = OrderedDict()
+_LLM_LOCK = threading.Lock()
+
+
+@functools.cache
+def _fast_language_model() -> Any:
+    """
+    Imports Unsloth on first model load: its CUDA/kernel patching costs
+    several seconds, which CLI paths that never reach the LLM should not pay.
+    """
+    from unsloth import FastLanguageModel
+
+    return FastLanguageModel
+
+
+def get_llm(model_name: str) -> Tuple[Any, Any]:
+    """
+    Returns a warm (model, tokenizer) pair for the given Unsloth checkpoint.
+    Weights are deserialized once per process; switching models evicts the
+    least recently used entry when the cache is full.
+    """
+    with _LLM_LOCK:
+        if model_name in _LLM_CACHE:
+            _LLM_CACHE.move_to_end(model_name)
+            logger.info(f"♻️ [LLM Registry] Cache hit for {model_name}.")
+            return _LLM_CACHE[model_name]
+
+        while len(_LLM_CACHE) >= LLM_CACHE_SIZE:
+            evicted_name, evicted = _LLM_CACHE.popitem(last=False)
+            logger.info(f"🧹 [LLM Registry] Evicting {evicted_name} from VRAM...")
+            del evicted
+            torch.cuda.empty_cache()
+
+        logger.info(f"📥 [LLM Registry] Loading {model_name} into VRAM (4-bit)...")
+        start = time.perf_counter()
+
+        FastLanguageModel = _fast_language_model()
+        model, tokenizer = FastLanguageModel.from_pretrained(
+            model_name=model_name,
+            max_seq_length=MAX_SEQ_LENGTH,
+            dtype=DTYPE,
+            load_in_4bit=LOAD_IN_4BIT,
+        )
+        FastLanguageModel.for_inference(model)  # Enable native 2x faster inference
+
+        _LLM_CACHE[model_name] = (model, tokenizer)
+        logger.info(
+            f"✅ [LLM Registry] {model_name} ready in {time.perf_counter() - start:.1f}s."
+        )
+        return model, tokenizer
+
+
+def unload_llms() -> None:
+    """Drops every cached checkpoint and releases its VRAM."""
+    with _LLM_LOCK:
+        if not _LLM_CACHE:
+            return
+        logger.info(f"🧹 [LLM Registry] Unloading {', '.join(_LLM_CACHE)} from VRAM...")
+        _LLM_CACHE.clear()
+    torch.cuda.empty_cache()
+
+
+# VoxCPM evicts the LLM through this when VRAM runs short
+register_evictor("reasoning LLM", unload_llms)
@@ -1,15 +1,134 @@
 import os
+import time
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Tuple
+
 import torch
-from unsloth import FastLanguageModel
 from langchain.tools import tool
 from src.core.config_manager import config
+from src.core.llm_registry import get_llm
+from src.core.vram_manager import run_with_vram_guard
+
+logger = logging.getLogger(__name__)
 
 # =====================================================================
-# CONFIGURATION
+# DYNAMIC BATCHING
 # =====================================================================
-MAX_SEQ_LENGTH = 2048
-DTYPE = None  # Auto-detect (bfloat16 for Ampere+, float16 for Tesla T4)
-LOAD_IN_4BIT = True
+# Reasoning calls that arrive while the GPU is busy (or within the short
+# collection window) are decoded together in one generate() call, so the
+# 4-bit weights are streamed once per step for the whole batch. A lone call
+# with nothing else pending or in flight skips the window entirely.
+BATCH_WINDOW_S = float(os.getenv("OMNIMED_LLM_BATCH_WINDOW_MS", "20")) / 1000
+MAX_LLM_BATCH = max(1, int(os.getenv("OMNIMED_LLM_MAX_BATCH", "4")))
+
+_PENDING: Dict[str, List[Tuple[List[dict], Future]]] = {}
+_PENDING_LOCK = threading.Lock()
+_ACTIVE_CALLS = 0
+_GENERATE_LOCK = threading.Lock()
+
+
+def _generate(
+    model_name: str, conversations: List[List[dict]], max_new_tokens: int = 512
+) -> List[str]:
+    """Runs one left-padded generate() over several chat conversations."""
+    model, tokenizer = get_llm(model_name)
+
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    # Decoder-only models must be padded on the left for batched generation
+    tokenizer.padding_side = "left"
+
+    # Apply the chat template
+    inputs = tokenizer.apply_chat_template(
+        conversations,
+        tokenize=True,
+        add_generation_prompt=True,
+        padding=True,
+        return_dict=True,
+        return_tensors="pt",
+    ).to("cuda")
+
+    # No autograd bookkeeping for pure inference
+    with torch.inference_mode():
+        outputs = model.generate(
+            input_ids=inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
+            max_new_tokens=max_new_tokens,
+            use_cache=True,
+            temperature=0.3,  # Low temperature for strict factual medical output
+            top_p=0.9,
+        )
+
+    # Decode and extract the generated text
+    prompt_length = inputs["input_ids"].shape[1]
+    return [
+        tokenizer.decode(output[prompt_length:], skip_special_tokens=True).strip()
+        for output in outputs
+    ]
+
+
+def _generate_batched(model_name: str, messages: List[dict]) -> str:
+    """
+    Queues one conversation for `model_name`. The first caller of a batch
+    becomes its leader: it waits out the collection window and for the GPU,
+    then generates for every conversation queued meanwhile.
+    """
+    global _ACTIVE_CALLS
+
+    future: Future = Future()
+    with _PENDING_LOCK:
+        queue = _PENDING.setdefault(model_name, [])
+        queue.append((messages, future))
+        is_leader = len(queue) == 1
+        _ACTIVE_CALLS += 1
+        has_company = _ACTIVE_CALLS > 1
+
+    try:
+        if is_leader:
+            if has_company:
+                time.sleep(BATCH_WINDOW_S)
+            with _GENERATE_LOCK:
+                # Requests that arrived while a previous batch held the GPU join here
+                with _PENDING_LOCK:
+                    batch = _PENDING.pop(model_name)
+
+                for start in range(0, len(batch), MAX_LLM_BATCH):
+                    chunk = batch[start : start + MAX_LLM_BATCH]
+                    if len(chunk) > 1:
+                        logger.info(
+                            "📦 [Reasoning Node] Decoding %d cases in one batch...",
+                            len(chunk),
+                        )
+                    try:
+                        # Evicts VoxCPM first if loading/decoding would not fit
+                        texts = run_with_vram_guard(
+                            "reasoning LLM",
+                            lambda: _generate(model_name, [m for m, _ in chunk]),
+                        )
+                        for (_, pending), text in zip(chunk, texts):
+                            pending.set_result(text)
+                    except Exception as e:
+                        for _, pending in chunk:
+                            pending.set_exception(e)
+
+        return future.result()
+    finally:
+        with _PENDING_LOCK:
+            _ACTIVE_CALLS -= 1
+
+
+def warm_up_llm(model_name: str) -> None:
+    """
+    Loads `model_name` and decodes a few tokens of a dummy prompt, so CUDA
+    kernels and the chat template are initialised before the first doctor
+    waits on them.
+    """
+    with _GENERATE_LOCK:
+        _generate(model_name, [[{"role": "user", "content": "Xin chào"}]], 8)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
 
 
 @tool
@@ -21,18 +140,9 @@ def invoke_clinical_reasoning(
     Returns a dictionary containing a detailed UI report and a short voice summary.
     """
     try:
-        print("🧠 [Reasoning Node] Allocating VRAM for Llama-3 8B (4-bit)...")
-
-        # 1. Load the optimized Unsloth model
-        model, tokenizer = FastLanguageModel.from_pretrained(
-            model_name=model_name,
-            max_seq_length=MAX_SEQ_LENGTH,
-            dtype=DTYPE,
-            load_in_4bit=LOAD_IN_4BIT,
-        )
-        FastLanguageModel.for_inference(model)  # Enable native 2x faster inference
+        print(f"🧠 [Reasoning Node] Preparing clinical prompt for {model_name}...")
 
-        # 2. Construct the Medical Prompt enforcing Anti-Hallucination, Diacritic Restoration, and Dual-Stream output
+        # 1. Construct the Medical Prompt enforcing Anti-Hallucination, Diacritic Restoration, and Dual-Stream output
         system_prompt = config.get_prompt("clinical_reasoning")
 
         user_message = (
@@ -46,29 +156,12 @@ def invoke_clinical_reasoning(
             {"role": "user", "content": user_message},
         ]
 
-        # Apply the chat template
-        inputs = tokenizer.apply_chat_template(
-            messages, tokenize=True, add_generation_prompt=True, return_tensors="pt"
-        ).to("cuda")
-
         print("🧠 [Reasoning Node] Analyzing data and generating clinical insights...")
 
-        # 3. Generate the response
-        outputs = model.generate(
-            input_ids=inputs,
-            max_new_tokens=512,
-            use_cache=True,
-            temperature=0.3,  # Low temperature for strict factual medical output
-            top_p=0.9,
-        )
+        # 2. Generate the response, batched with any concurrent cases
+        response_text = _generate_batched(model_name, messages)
 
-        # 4. Decode and extract the generated text
-        prompt_length = inputs.shape[1]
-        response_text = tokenizer.decode(
-            outputs[0][prompt_length:], skip_special_tokens=True
-        ).strip()
-
-        # 5. Parse the output to separate the UI text and Voice text
+        # 3. Parse the output to separate the UI text and Voice text
         ui_report = response_text
         voice_summary = config.get_prompt("voice_summary")  # Fallback safety
 
@@ -78,13 +171,6 @@ def invoke_clinical_reasoning(
             if len(parts) > 1:
                 voice_summary = parts[1].strip()
 
-        print(
-            "🧹 [Memory Manager] Unloading Llama-3 to free up VRAM for other tools..."
-        )
-        del model
-        del tokenizer
-        torch.cuda.empty_cache()
-
         print("✅ [Reasoning Node] Clinical reasoning complete.")
 
         return {"final_diagnosis": ui_report, "voice_summary": voice_summary}
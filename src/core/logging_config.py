@@ -0,0 +1,64 @@
+import os
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Optional
+
+# =====================================================================
+# ENTERPRISE LOGGING CONFIGURATION
+# =====================================================================
+LOG_FORMAT = "%(asctime)s | %(levelname)-8s | %(name)s | %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_LISTENER: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers (OMNIMED_LOG_FORMAT=json)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+def configure_logging(level: int = logging.INFO) -> None:
+    """
+    Routes the root logger through a QueueHandler so request threads only
+    enqueue records; a single background QueueListener performs the blocking
+    stderr writes. Safe to call from every entrypoint (idempotent).
+    """
+    global _LISTENER
+    if _LISTENER is not None:
+        return
+
+    # None of the formats print thread/process/caller info, so skip
+    # collecting it on every record (see "Optimization" in the logging docs)
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    logging._srcfile = None
+
+    stream_handler = logging.StreamHandler()
+    if os.getenv("OMNIMED_LOG_FORMAT", "").lower() == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _LISTENER = logging.handlers.QueueListener(log_queue, stream_handler)
+    _LISTENER.start()
+    # Flush whatever is still queued when the interpreter exits
+    atexit.register(_LISTENER.stop)
+
+    root_logger = logging.getLogger()
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    root_logger.setLevel(level)
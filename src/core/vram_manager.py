@@ -0,0 +1,93 @@
+import os
+import logging
+import threading
+from typing import Callable, Dict, TypeVar
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# =====================================================================
+# CONFIGURATION
+# =====================================================================
+# The LLM and VoxCPM stay resident by default. Before either loads or
+# generates, every *other* resident model is unloaded when less than this
+# much VRAM is available (free plus the allocator's idle cache), and a CUDA
+# out-of-memory error triggers the same eviction followed by one retry.
+# 0 disables the pre-check; OOM recovery stays active.
+MIN_FREE_VRAM_MB = int(os.getenv("OMNIMED_MIN_FREE_VRAM_MB", "2048"))
+
+# =====================================================================
+# EVICTION REGISTRY
+# =====================================================================
+# Owners register their own unload helper, so core modules can evict the TTS
+# model without importing the (heavy) tool that holds it.
+_EVICTORS: Dict[str, Callable[[], None]] = {}
+_EVICTORS_LOCK = threading.Lock()
+
+
+def register_evictor(owner: str, unload: Callable[[], None]) -> None:
+    """Registers the helper that drops `owner`'s resident model."""
+    with _EVICTORS_LOCK:
+        _EVICTORS[owner] = unload
+
+
+def evict_others(owner: str) -> None:
+    """Unloads every registered model except `owner`'s own."""
+    with _EVICTORS_LOCK:
+        evictors = [(name, fn) for name, fn in _EVICTORS.items() if name != owner]
+
+    for name, unload in evictors:
+        logger.info(f"🧹 [Memory Manager] Evicting the {name} model for {owner}...")
+        try:
+            unload()
+        except Exception as e:
+            logger.warning(f"⚠️ [Memory Manager] Could not evict {name}: {e}")
+
+
+def available_vram_bytes() -> int:
+    """Driver-free VRAM plus memory PyTorch has reserved but is not using."""
+    free_bytes, _ = torch.cuda.mem_get_info()
+    return free_bytes + torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+
+
+def ensure_vram_headroom(owner: str) -> None:
+    """Evicts the other resident models when VRAM runs below the threshold."""
+    if MIN_FREE_VRAM_MB <= 0 or not torch.cuda.is_available():
+        return
+
+    available = available_vram_bytes()
+    if available < MIN_FREE_VRAM_MB * 1024 * 1024:
+        logger.info(
+            f"⚠️ [Memory Manager] Only {available / 1024**2:.0f} MB of VRAM available "
+            f"(threshold {MIN_FREE_VRAM_MB} MB)."
+        )
+        evict_others(owner)
+
+
+def _is_cuda_oom(error: BaseException) -> bool:
+    # torch.cuda.OutOfMemoryError subclasses RuntimeError; older builds and
+    # some kernels only raise a plain RuntimeError with this message
+    return isinstance(error, RuntimeError) and "out of memory" in str(error).lower()
+
+
+def run_with_vram_guard(owner: str, fn: Callable[[], T]) -> T:
+    """
+    Runs a GPU load or generate step for `owner`, freeing VRAM held by other
+    models first when it is scarce, and once more if the step hits CUDA OOM.
+    """
+    ensure_vram_headroom(owner)
+    try:
+        return fn()
+    except RuntimeError as e:
+        if not _is_cuda_oom(e):
+            raise
+        logger.warning(f"⚠️ [Memory Manager] CUDA out of memory in {owner}: {e}")
+
+    # Retry outside the except block: the traceback would otherwise keep the
+    # failed attempt's tensors alive while the next one allocates
+    evict_others(owner)
+    torch.cuda.empty_cache()
+    return fn()
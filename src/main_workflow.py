@@ -1,6 +1,13 @@
+import io
+import sys
+import json
 import logging
-from typing import TypedDict, Optional, Dict, Any
-from langgraph.graph import StateGraph, END
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import TypedDict, Optional, Dict, Any, List
+from langgraph.graph import StateGraph, START, END
 from langgraph.checkpoint.memory import MemorySaver
 import re
 import os
@@ -11,16 +18,13 @@ from src.tools.ehr_rag_tool import search_patient_records
 from src.tools.voice_tts_tool import generate_clinical_voice_alert
 from src.core.local_llm import invoke_clinical_reasoning
 from src.core.config_manager import config
+from src.core.logging_config import configure_logging
 
 # =====================================================================
 # 0. ENTERPRISE LOGGING CONFIGURATION
 # =====================================================================
-# Configure the root logger with a standard formatting pattern
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)-8s | %(name)s | %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+# Configure the root logger once; records are written off-thread
+configure_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -34,6 +38,7 @@ class MedicalState(TypedDict, total=False):
     llm_model_id: Optional[str]
     prompt_wav_path: Optional[str]
     prompt_text: Optional[str]
+    interactive: bool
 
     ocr_extracted_text: Optional[str]
     sanitized_text: Optional[str]
@@ -47,33 +52,94 @@ class MedicalState(TypedDict, total=False):
 # =====================================================================
 # 2. DEFINE THE GRAPH NODES WITH ROBUST LOGGING
 # =====================================================================
+def _tool_output_text(result: Any, *keys: str) -> str:
+    """
+    Flattens a tool result into text. Dict results yield their first present
+    key; anything still structured becomes compact JSON (not a Python repr)
+    so the LLM receives something it can actually parse.
+    """
+    if isinstance(result, dict):
+        result = next((result[key] for key in keys if key in result), result)
+    if isinstance(result, (dict, list)):
+        return json.dumps(result, ensure_ascii=False, default=str)
+    return str(result)
+
+
 def vision_node(state: MedicalState) -> Dict[str, Any]:
     logger.info("▶️ [STEP 1] EXECUTING VISION NODE...")
     try:
         doc_path = state.get("document_path")
-        if not doc_path or not os.path.exists(doc_path):
+        if not doc_path:
             logger.warning("[Vision Node] No valid document provided. Skipping OCR.")
             return {"ocr_extracted_text": "No document attached."}
 
+        # No pre-stat here: the OCR tool's own stat reports a missing file
         ocr_result = extract_medical_document_ocr.invoke({"file_path": doc_path})
 
-        if isinstance(ocr_result, dict):
-            ocr_text = ocr_result.get("output", ocr_result.get("text", str(ocr_result)))
-        else:
-            ocr_text = str(ocr_result)
+        ocr_text = _tool_output_text(ocr_result, "output", "text")
+
+        if ocr_text.startswith("FILE NOT FOUND"):
+            logger.warning("[Vision Node] No valid document provided. Skipping OCR.")
+            return {"ocr_extracted_text": "No document attached."}
 
         logger.info("[Vision Node] OCR extraction completed successfully.")
         return {"ocr_extracted_text": ocr_text}
 
     except Exception as e:
         # exc_info=True automatically attaches the stack trace to the log for easy debugging
-        logger.error(f"[Vision Node Error]: {str(e)}", exc_info=True)
+        logger.error("[Vision Node Error]: %s", e, exc_info=True)
         return {"ocr_extracted_text": f"OCR Processing Failed: {str(e)}"}
 
 
 # =====================================================================
 # SECURITY COMPLIANCE: PHI/PII REDACTION ENGINE
 # =====================================================================
+# Dynamic Pathing: optional site-specific literals (hospital names, physician
+# names, device serials), one per line; '#' starts a comment line.
+PHI_TERMS_PATH = Path(__file__).resolve().parent.parent / "configs" / "phi_terms.txt"
+
+_PHI_PATTERN = (
+    r"(?P<PHONE>\b(?:0[3|5|7|8|9])+[0-9]{8}\b)"
+    # Common Vietnamese names (simplified example)
+    r"|(?P<NAME>(?P<label>Bệnh nhân|Họ và tên|Tên bệnh nhân):\s*[A-ZÀÁÂÃÈÉÊÌÍÒÓÔÕÙÚĂĐĨŨƠƯĂẠẢẤẦẨẪẬẮẰẲẴẶẸẺẼỀỀỂỄỆỈỊỌỎỐỒỔỖỘỚỜỞỠỢỤỦỨỪỬỮỰỲỴÝỶỸa-zàáâãèéêìíòóôõùúăđĩũơưăạảấầẩẫậắằẳẵặẹẻẽềềểễệỉịọỏốồổỗộớờởỡợụủứừửữựỳỵỷỹ\s]+)"
+)
+
+
+def _load_phi_terms(path: Path) -> List[str]:
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except FileNotFoundError:
+        return []
+    return [line.strip() for line in lines if line.strip() and not line.startswith("#")]
+
+
+def build_phi_pattern(terms: List[str]) -> re.Pattern:
+    """
+    Phone numbers, labelled patient names and any dictionary literals fused
+    into one alternation, so a large OCR blob is scanned in a single pass.
+    Literals are tried longest-first and must not sit inside a larger word.
+    """
+    pattern = _PHI_PATTERN
+    if terms:
+        literals = "|".join(
+            re.escape(term) for term in sorted(set(terms), key=len, reverse=True)
+        )
+        pattern += rf"|(?P<TERM>(?<!\w)(?:{literals})(?!\w))"
+    return re.compile(pattern)
+
+
+# Compiled once at import
+_RE_PHI = build_phi_pattern(_load_phi_terms(PHI_TERMS_PATH))
+
+
+def _redact_match(match: re.Match) -> str:
+    if match.lastgroup == "PHONE":
+        return "[REDACTED_PHONE]"
+    if match.lastgroup == "TERM":
+        return "[REDACTED_TERM]"
+    return f"{match.group('label')}: [REDACTED_NAME]"
+
+
 def redact_sensitive_info(text: str) -> str:
     """
     Redacts Personally Identifiable Information (PII) using heuristic Regex.
@@ -88,16 +154,34 @@ def redact_sensitive_info(text: str) -> str:
     if not text:
         return text
 
-    # Redact standard phone numbers
-    redacted_text = re.sub(r"\b(0[3|5|7|8|9])+([0-9]{8})\b", "[REDACTED_PHONE]", text)
+    # Redact phone numbers, labelled names and dictionary terms in one pass
+    return _RE_PHI.sub(_redact_match, text)
 
-    # Redact common Vietnamese names (simplified example)
-    redacted_text = re.sub(
-        r"(Bệnh nhân|Họ và tên|Tên bệnh nhân):\s*([A-ZÀÁÂÃÈÉÊÌÍÒÓÔÕÙÚĂĐĨŨƠƯĂẠẢẤẦẨẪẬẮẰẲẴẶẸẺẼỀỀỂỄỆỈỊỌỎỐỒỔỖỘỚỜỞỠỢỤỦỨỪỬỮỰỲỴÝỶỸa-zàáâãèéêìíòóôõùúăđĩũơưăạảấầẩẫậắằẳẵặẹẻẽềềểễệỉịọỏốồổỗộớờởỡợụủứừửữựỳỵỷỹ\s]+)",
-        r"\1: [REDACTED_NAME]",
-        redacted_text,
-    )
-    return redacted_text
+
+# Retries of the same document skip the regex pass. Keys are digests of the
+# raw text and values are already redacted, so no PHI is held here.
+SANITIZED_CACHE_SIZE = 1024
+_SANITIZED_CACHE: "OrderedDict[bytes, str]" = OrderedDict()
+_SANITIZED_CACHE_LOCK = threading.Lock()
+
+
+def _sanitize_cached(raw_text: str) -> str:
+    key = hashlib.blake2b(raw_text.encode("utf-8"), digest_size=16).digest()
+    with _SANITIZED_CACHE_LOCK:
+        if key in _SANITIZED_CACHE:
+            _SANITIZED_CACHE.move_to_end(key)
+            logger.info(
+                "♻️ [Sanitization Node] Document already redacted; reusing result."
+            )
+            return _SANITIZED_CACHE[key]
+
+    safe_text = redact_sensitive_info(raw_text)
+
+    with _SANITIZED_CACHE_LOCK:
+        _SANITIZED_CACHE[key] = safe_text
+        while len(_SANITIZED_CACHE) > SANITIZED_CACHE_SIZE:
+            _SANITIZED_CACHE.popitem(last=False)
+    return safe_text
 
 
 def sanitization_node(state: MedicalState) -> Dict[str, Any]:
@@ -118,33 +202,75 @@ def sanitization_node(state: MedicalState) -> Dict[str, Any]:
             logger.warning("[Sanitization Node] No valid text to sanitize. Bypassing.")
             return {"sanitized_text": raw_text}
 
-        # Apply redaction heuristics
-        safe_text = redact_sensitive_info(raw_text)
+        # Apply redaction heuristics (memoized per document content)
+        safe_text = _sanitize_cached(raw_text)
 
         logger.info("[Sanitization Node] PII/PHI successfully redacted.")
-        return {"sanitized_text": safe_text}
+        # Drop the raw OCR text so the unredacted copy is not carried (and
+        # checkpointed) for the rest of the session alongside the safe one
+        return {"sanitized_text": safe_text, "ocr_extracted_text": None}
 
     except Exception as e:
-        logger.error(f"[Sanitization Node Error]: {str(e)}", exc_info=True)
+        logger.error("[Sanitization Node Error]: %s", e, exc_info=True)
         return {"error_message": f"Security Module Failed: {str(e)}"}
 
 
+# =====================================================================
+# RAG RESULT CACHE
+# =====================================================================
+# Templated doctor queries recur across patients; identical (normalized)
+# queries reuse the retrieved context instead of re-running the vector search.
+RAG_CACHE_SIZE = 2048
+_RAG_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_RAG_CACHE_LOCK = threading.Lock()
+
+
+def _rag_cache_key(query: str) -> str:
+    normalized = " ".join(query.split()).lower()
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _search_context(query: str) -> str:
+    rag_result = search_patient_records.invoke({"query": query})
+    return _tool_output_text(rag_result, "output")
+
+
+def _cached_search_context(query: str) -> str:
+    key = _rag_cache_key(query)
+    with _RAG_CACHE_LOCK:
+        if key in _RAG_CACHE:
+            _RAG_CACHE.move_to_end(key)
+            logger.info("♻️ [RAG Node] Serving clinical context from cache.")
+            return _RAG_CACHE[key]
+
+    context_str = _search_context(query)
+
+    # Never pin a transient retrieval failure in the cache
+    if not context_str.startswith("CRITICAL ERROR"):
+        with _RAG_CACHE_LOCK:
+            _RAG_CACHE[key] = context_str
+            while len(_RAG_CACHE) > RAG_CACHE_SIZE:
+                _RAG_CACHE.popitem(last=False)
+    return context_str
+
+
 def rag_node(state: MedicalState) -> Dict[str, Any]:
     logger.info("▶️ [STEP 2] EXECUTING RAG NODE...")
     try:
         query = state.get("doctor_query", "")
-        rag_result = search_patient_records.invoke({"query": query})
+        patient_id = state.get("patient_id")
+
+        # Patient-specific queries are one-offs; don't let them churn the cache
+        if patient_id and patient_id in query:
+            context_str = _search_context(query)
+        else:
+            context_str = _cached_search_context(query)
 
-        context_str = (
-            str(rag_result)
-            if not isinstance(rag_result, dict)
-            else str(rag_result.get("output", rag_result))
-        )
         logger.info("[RAG Node] Clinical context retrieved successfully.")
         return {"rag_clinical_context": context_str}
 
     except Exception as e:
-        logger.error(f"[RAG Node Error]: {str(e)}", exc_info=True)
+        logger.error("[RAG Node Error]: %s", e, exc_info=True)
         return {"rag_clinical_context": "Failed to retrieve medical context."}
 
 
@@ -155,7 +281,7 @@ def reasoning_node(state: MedicalState) -> Dict[str, Any]:
             "llm_model_id", "unsloth/llama-3-8b-Instruct-bnb-4bit"
         )
         logger.info(
-            f"[Reasoning Node] Initializing LLM Engine with model: {selected_model}"
+            "[Reasoning Node] Initializing LLM Engine with model: %s", selected_model
         )
 
         llm_result = invoke_clinical_reasoning.invoke(
@@ -186,7 +312,7 @@ def reasoning_node(state: MedicalState) -> Dict[str, Any]:
         }
 
     except Exception as e:
-        logger.error(f"[Reasoning Node Error]: {str(e)}", exc_info=True)
+        logger.error("[Reasoning Node Error]: %s", e, exc_info=True)
         return {
             "final_diagnosis": f"LLM Inference Failed: {str(e)}",
             "voice_summary": "Đã xảy ra lỗi hệ thống trong quá trình phân tích.",
@@ -203,7 +329,7 @@ def voice_node(state: MedicalState) -> Dict[str, Any]:
         if ref_wav and ref_text:
             logger.info("[Voice Node] Voice Cloning Activated using reference audio.")
         else:
-            logger.info(f"[Voice Node] Synthesizing standard audio for TTS.")
+            logger.info("[Voice Node] Synthesizing standard audio for TTS.")
 
         audio_path = generate_clinical_voice_alert.invoke(
             {
@@ -213,19 +339,30 @@ def voice_node(state: MedicalState) -> Dict[str, Any]:
             }
         )
 
-        final_audio_path = (
-            audio_path.get("output", str(audio_path))
-            if isinstance(audio_path, dict)
-            else str(audio_path)
-        )
+        final_audio_path = _tool_output_text(audio_path, "output")
         logger.info("[Voice Node] Audio alert synthesized successfully.")
         return {"voice_alert_path": final_audio_path}
 
     except Exception as e:
-        logger.error(f"[Voice Node Error]: {str(e)}", exc_info=True)
+        logger.error("[Voice Node Error]: %s", e, exc_info=True)
         return {"voice_alert_path": None}
 
 
+def doctor_approval_node(state: MedicalState) -> Dict[str, Any]:
+    """Checkpoint anchor for the HITL pause; resuming past it means approval."""
+    logger.info("👨‍⚕️ [HITL] Doctor approval received. Releasing voice synthesis...")
+    return {}
+
+
+def route_after_reasoning(state: MedicalState) -> str:
+    """
+    Interactive sessions detour through Doctor_Approval (where the graph
+    interrupts). Unconditionally auto-approved runs go straight to voice so
+    the whole case completes in a single invoke without a checkpoint round-trip.
+    """
+    return "pause" if state.get("interactive", True) else "continue"
+
+
 # =====================================================================
 # 3. BUILD AND COMPILE THE LANGGRAPH WORKFLOW
 # =====================================================================
@@ -235,13 +372,21 @@ workflow.add_node("Vision_OCR", vision_node)
 workflow.add_node("Data_Sanitization", sanitization_node)
 workflow.add_node("EHR_RAG", rag_node)
 workflow.add_node("Clinical_Reasoning", reasoning_node)
+workflow.add_node("Doctor_Approval", doctor_approval_node)
 workflow.add_node("Voice_Alert", voice_node)
 
-workflow.set_entry_point("Vision_OCR")
+# RAG only needs the doctor's query, so it runs in parallel with the
+# OCR -> Sanitization branch; reasoning waits for both branches to finish.
+workflow.add_edge(START, "Vision_OCR")
+workflow.add_edge(START, "EHR_RAG")
 workflow.add_edge("Vision_OCR", "Data_Sanitization")
-workflow.add_edge("Data_Sanitization", "EHR_RAG")
-workflow.add_edge("EHR_RAG", "Clinical_Reasoning")
-workflow.add_edge("Clinical_Reasoning", "Voice_Alert")
+workflow.add_edge(["Data_Sanitization", "EHR_RAG"], "Clinical_Reasoning")
+workflow.add_conditional_edges(
+    "Clinical_Reasoning",
+    route_after_reasoning,
+    {"pause": "Doctor_Approval", "continue": "Voice_Alert"},
+)
+workflow.add_edge("Doctor_Approval", "Voice_Alert")
 workflow.add_edge("Voice_Alert", END)
 
 
@@ -249,70 +394,103 @@ workflow.add_edge("Voice_Alert", END)
 # Initialize memory to save the graph state during pauses
 memory = MemorySaver()
 
-# Compile the graph with a strict interruption BEFORE synthesizing voice
-omnimed_app = workflow.compile(checkpointer=memory, interrupt_before=["Voice_Alert"])
+# Compile the graph with a strict interruption BEFORE the doctor's approval gate
+omnimed_app = workflow.compile(
+    checkpointer=memory, interrupt_before=["Doctor_Approval"]
+)
+
+# Non-interactive callers never resume a paused thread, so this variant skips
+# the checkpointer entirely: no per-node state snapshots, no thread_id plumbing.
+omnimed_app_ephemeral = workflow.compile()
+
+
+def release_session(thread_id: str) -> None:
+    """Drops a finished HITL session's checkpoints from the in-memory saver."""
+    memory.delete_thread(thread_id)
+
 
 # =====================================================================
 # 4. RUNNABLE DEMO / CLI INTERFACE
 # =====================================================================
+def _print_banner(title: str, body: Optional[str]) -> None:
+    """Writes a framed report section to stdout in a single write and flush."""
+    buf = io.StringIO()
+    buf.write("\n" + "=" * 50 + "\n")
+    buf.write(f"{title}\n")
+    buf.write("=" * 50 + "\n")
+    buf.write(f"{body}\n")
+    sys.stdout.write(buf.getvalue())
+    sys.stdout.flush()
+
+
 if __name__ == "__main__":
     logger.info("=" * 50)
     logger.info("🏥 OMNIMED-AGENT-OS: INITIALIZATION COMPLETE")
     logger.info("=" * 50)
 
+    auto_approve = os.getenv("AUTO_APPROVE", "false").lower() in ("true", "1", "t")
+
     test_state: MedicalState = {
         "doctor_query": config.get_prompt("doctor_query"),
         "patient_id": "BN_001",
         "document_path": "data/images/test_receipt.jpg",
         "prompt_wav_path": "data/voice_alerts/sample.wav",
         "prompt_text": config.get_prompt("video_prompt"),
+        # Auto-approved runs skip the HITL pause and finish in one invoke
+        "interactive": not auto_approve,
     }
 
-    # Unique thread ID to track this specific patient's session
+    # Unique thread ID to track this specific patient's HITL session
     thread_config = {"configurable": {"thread_id": "session_BN_001"}}
 
     try:
-        logger.info("🚀 PHASE 1: Executing Automated Analysis (OCR -> RAG -> LLM)...")
-        # First invocation: It will run and PAUSE right before 'Voice_Alert'
-        initial_run_state = omnimed_app.invoke(test_state, config=thread_config)
-
-        # Display the AI's clinical reasoning for the Doctor to review
-        print("\n" + "=" * 50)
-        print("📋 [PENDING DOCTOR APPROVAL] CLINICAL REPORT:")
-        print("=" * 50)
-        print(initial_run_state.get("final_diagnosis", "No diagnosis generated."))
-
-        # Manually prompt the user (Doctor) in the CLI
-        print("\n" + "=" * 50)
-
-        auto_approve = os.getenv("AUTO_APPROVE", "false").lower() in ("true", "1", "t")
-
         if auto_approve:
             print(
-                "🤖 [Colab Mode] AUTO_APPROVE enabled. Automatically generating Voice Alert..."
+                "🤖 [Colab Mode] AUTO_APPROVE enabled. Running OCR -> RAG -> LLM -> Voice in a single pass..."
+            )
+            final_state = omnimed_app_ephemeral.invoke(test_state)
+
+            _print_banner(
+                "📋 [AUTO-APPROVED] CLINICAL REPORT:",
+                final_state.get("final_diagnosis", "No diagnosis generated."),
             )
-            user_input = "y"
         else:
+            logger.info(
+                "🚀 PHASE 1: Executing Automated Analysis (OCR -> RAG -> LLM)..."
+            )
+            # First invocation: It will run and PAUSE right before 'Doctor_Approval'
+            initial_run_state = omnimed_app.invoke(test_state, config=thread_config)
+
+            # Display the AI's clinical reasoning for the Doctor to review
+            _print_banner(
+                "📋 [PENDING DOCTOR APPROVAL] CLINICAL REPORT:",
+                initial_run_state.get("final_diagnosis", "No diagnosis generated."),
+            )
+
+            # Manually prompt the user (Doctor) in the CLI
             user_input = input(
-                "👨‍⚕️ ACTION REQUIRED: Approve this report to generate Voice Alert? (y/n): "
+                "\n"
+                + "=" * 50
+                + "\n👨‍⚕️ ACTION REQUIRED: Approve this report to generate Voice Alert? (y/n): "
             )
 
-        if user_input.lower().strip() == "y":
-            logger.info(
-                "✅ Doctor Approved. Resuming workflow to generate Voice Alert..."
+            if user_input.lower().strip() == "y":
+                logger.info(
+                    "✅ Doctor Approved. Resuming workflow to generate Voice Alert..."
+                )
+                # Second invocation: Passing None with the same config resumes the paused graph
+                final_state = omnimed_app.invoke(None, config=thread_config)
+            else:
+                logger.warning(
+                    "❌ Doctor Rejected the report. Voice synthesis cancelled."
+                )
+                final_state = None
+
+        if final_state is not None:
+            _print_banner(
+                "🔊 FINAL VOICE SUMMARY (TTS)", final_state.get("voice_summary")
             )
-            # Second invocation: Passing None with the same config resumes the paused graph
-            final_state = omnimed_app.invoke(None, config=thread_config)
-
-            print("\n" + "=" * 50)
-            print("🔊 FINAL VOICE SUMMARY (TTS)")
-            print("=" * 50)
-            print(final_state.get("voice_summary"))
-            logger.info(f"🎙️ AUDIO ALERT PATH: {final_state.get('voice_alert_path')}")
-        else:
-            logger.warning("❌ Doctor Rejected the report. Voice synthesis cancelled.")
+            logger.info("🎙️ AUDIO ALERT PATH: %s", final_state.get("voice_alert_path"))
 
     except Exception as e:
-        logger.critical(
-            f"❌ [Critical Failure] Workflow crashed: {str(e)}", exc_info=True
-        )
+        logger.critical("❌ [Critical Failure] Workflow crashed: %s", e, exc_info=True)
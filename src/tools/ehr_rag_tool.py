@@ -1,8 +1,12 @@
 import os
 import logging
+import threading
+from typing import List, Tuple
+
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.tools import tool
+from src.core.embed_cache import CachedQueryEmbeddings
+from src.core.embeddings import Fp32NormalizedEmbeddings
 
 logger = logging.getLogger(__name__)
 
@@ -11,35 +15,99 @@ logger = logging.getLogger(__name__)
 # =====================================================================
 EMBEDDING_MODEL_NAME = "bkai-foundation-models/vietnamese-bi-encoder"
 CHROMA_DB_DIR = "./data/vietnamese_med_corpus/chroma_db"
+# Queries are short, so a modest batch keeps one forward pass within VRAM
+QUERY_EMBED_BATCH_SIZE = 16
+TOP_K = 3
+# Retrieved records less similar than this (cosine, -1..1) are dropped rather
+# than padding the prompt with unrelated history. -1 keeps all TOP_K hits.
+MIN_SIMILARITY = float(os.getenv("OMNIMED_RAG_MIN_SIMILARITY", "-1"))
 
 _EMBEDDINGS_CACHE = None
 _CHROMA_DB_CACHE = None
+# Parallel graph branches may hit a cold cache together; load the model once
+_VECTOR_DB_LOCK = threading.Lock()
+
+
+def _load_query_embeddings() -> Fp32NormalizedEmbeddings:
+    import torch
+
+    dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    logger.info(
+        f"🧠 [RAG Singleton] Loading Embedding Model into VRAM ({dtype}) for the first time..."
+    )
+    return Fp32NormalizedEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        model_kwargs={"device": "cuda", "model_kwargs": {"torch_dtype": dtype}},
+        encode_kwargs={
+            "normalize_embeddings": False,
+            "batch_size": QUERY_EMBED_BATCH_SIZE,
+            "convert_to_numpy": True,
+        },
+    )
 
 
 def get_vietnamese_vector_db() -> Chroma:
+    if _CHROMA_DB_CACHE is not None:
+        return _CHROMA_DB_CACHE
+
+    with _VECTOR_DB_LOCK:
+        return _load_vietnamese_vector_db()
+
+
+def _load_vietnamese_vector_db() -> Chroma:
     global _EMBEDDINGS_CACHE, _CHROMA_DB_CACHE
 
     if _EMBEDDINGS_CACHE is None:
-        logger.info(
-            "🧠 [RAG Singleton] Loading Embedding Model into VRAM for the first time..."
-        )
-        _EMBEDDINGS_CACHE = HuggingFaceEmbeddings(
-            model_name=EMBEDDING_MODEL_NAME,
-            model_kwargs={"device": "cuda"},
-            encode_kwargs={"normalize_embeddings": True},
-        )
+        _EMBEDDINGS_CACHE = _load_query_embeddings()
 
     if _CHROMA_DB_CACHE is None:
         logger.info("💾 [RAG Singleton] Connecting to ChromaDB...")
         _CHROMA_DB_CACHE = Chroma(
             collection_name="vietnamese_ehr_records",
-            embedding_function=_EMBEDDINGS_CACHE,
+            embedding_function=CachedQueryEmbeddings(
+                _EMBEDDINGS_CACHE, EMBEDDING_MODEL_NAME
+            ),
             persist_directory=CHROMA_DB_DIR,
         )
 
     return _CHROMA_DB_CACHE
 
 
+def _cosine_similarity(distance: float, space: str) -> float:
+    """Maps a Chroma distance for unit-norm vectors back to cosine similarity."""
+    # hnswlib reports both cosine and inner-product distance as 1 - dot
+    if space in ("cosine", "ip"):
+        return 1.0 - distance
+    # Squared L2 between unit vectors is 2 * (1 - cos)
+    return 1.0 - distance / 2.0
+
+
+def _relevant_docs(db: Chroma, scored_docs: List[Tuple]) -> List:
+    space = (db._collection.metadata or {}).get("hnsw:space", "l2")
+    docs = []
+    for doc, distance in scored_docs:
+        similarity = _cosine_similarity(distance, space)
+        logger.debug(f"[RAG Node] Candidate record similarity: {similarity:.3f}")
+        if similarity >= MIN_SIMILARITY:
+            docs.append(doc)
+    return docs
+
+
+def _format_context(docs) -> str:
+    if not docs:
+        logger.warning(
+            "No relevant medical data found in the patient records database."
+        )
+        return (
+            "WARNING: No relevant medical data found in the patient records database."
+        )
+
+    context = "\n\n--- RETRIEVED MEDICAL CONTEXT ---\n\n".join(
+        [doc.page_content for doc in docs]
+    )
+    return f"Retrieved Context from Vietnamese EHR Database:\n\n{context}"
+
+
 @tool
 def search_patient_records(query: str) -> str:
     """Use this tool to search for patient medical records..."""
@@ -47,22 +115,46 @@ def search_patient_records(query: str) -> str:
         logger.info(f"🔍 [RAG Node] Executing semantic search for query: '{query}'...")
 
         db = get_vietnamese_vector_db()
-        docs = db.similarity_search(query, k=3)
+        docs = _relevant_docs(db, db.similarity_search_with_score(query, k=TOP_K))
 
-        if not docs:
-            logger.warning(
-                "No relevant medical data found in the patient records database."
+        if docs:
+            logger.info(
+                "✅ [RAG Node] Successfully retrieved relevant medical history."
             )
-            return "WARNING: No relevant medical data found in the patient records database."
+        return _format_context(docs)
 
-        context = "\n\n--- RETRIEVED MEDICAL CONTEXT ---\n\n".join(
-            [doc.page_content for doc in docs]
+    except Exception as e:
+        error_msg = f"CRITICAL ERROR retrieving RAG context: {str(e)}"
+        logger.error(f"❌ {error_msg}", exc_info=True)
+        return error_msg
+
+
+def search_patient_records_batch(queries: List[str]) -> List[str]:
+    """
+    Batched variant of search_patient_records: all queries are embedded in
+    one forward pass, then each precomputed vector is searched directly so
+    Chroma does not re-embed it.
+    """
+    try:
+        logger.info(
+            f"🔍 [RAG Node] Executing semantic search for {len(queries)} queries..."
         )
 
-        logger.info("✅ [RAG Node] Successfully retrieved relevant medical history.")
-        return f"Retrieved Context from Vietnamese EHR Database:\n\n{context}"
+        db = get_vietnamese_vector_db()
+        vectors = db.embeddings.embed_documents(queries)
+        return [
+            _format_context(
+                _relevant_docs(
+                    db,
+                    db.similarity_search_by_vector_with_relevance_scores(
+                        vector, k=TOP_K
+                    ),
+                )
+            )
+            for vector in vectors
+        ]
 
     except Exception as e:
         error_msg = f"CRITICAL ERROR retrieving RAG context: {str(e)}"
         logger.error(f"❌ {error_msg}", exc_info=True)
-        return error_msg
+        return [error_msg] * len(queries)
@@ -1,11 +1,20 @@
 import os
+
+# Expandable segments let the caching allocator grow blocks in place instead
+# of fragmenting VRAM between the LLM, bi-encoder and VoxCPM; read at the
+# first CUDA allocation, so it must be set before any model is loaded.
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+
 import torch
+import hashlib
 import logging
+import threading
 from pathlib import Path
 from langchain.tools import tool
 import soundfile as sf
 from voxcpm import VoxCPM
 from typing import Optional
+from src.core.vram_manager import register_evictor, run_with_vram_guard
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +27,125 @@ HF_REPO_ID = "JayLL13/VoxCPM-1.5-VN"
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 VOICE_OUT_DIR = BASE_DIR / "data" / "voice_alerts"
 
+# Keep VoxCPM resident between alerts (default). Under VRAM pressure it is
+# still evicted on demand (see OMNIMED_MIN_FREE_VRAM_MB); set this to false to
+# unload it after every alert instead.
+TTS_RESIDENT = os.getenv("OMNIMED_TTS_RESIDENT", "true").lower() in ("true", "1", "t")
+
+# LocDiT denoising dominates synthesis time. Short alerts are intelligible with
+# fewer diffusion steps; anything longer keeps the original step count.
+SHORT_ALERT_CHARS = 80
+SHORT_ALERT_TIMESTEPS = 8
+DEFAULT_TIMESTEPS = 10
+
+CFG_VALUE = 2.0
+
+# empty_cache() synchronizes the device and throws away the allocator's cache,
+# so only hand VRAM back to the driver when this much sits reserved but idle.
+IDLE_VRAM_THRESHOLD_MB = int(os.getenv("OMNIMED_IDLE_VRAM_THRESHOLD_MB", "1024"))
+
+# Synthesized alerts are stored under a digest of everything that shapes the
+# audio, so a recurring alert is served from disk instead of re-synthesized.
+MAX_CACHED_ALERTS = 256
+
+_TTS_MODEL_CACHE = None
+_TTS_LOCK = threading.Lock()
+
+
+def get_tts_model() -> VoxCPM:
+    """Loads VoxCPM onto the GPU on first use and reuses it afterwards."""
+    global _TTS_MODEL_CACHE
+
+    with _TTS_LOCK:
+        if _TTS_MODEL_CACHE is None:
+            logger.info(
+                "📥 [Voice Node] Loading VoxCPM model into GPU. This may take a moment..."
+            )
+            _TTS_MODEL_CACHE = VoxCPM.from_pretrained(HF_REPO_ID)
+        return _TTS_MODEL_CACHE
+
+
+def _release_idle_vram() -> None:
+    if not torch.cuda.is_available():
+        return
+    idle_bytes = torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+    if idle_bytes > IDLE_VRAM_THRESHOLD_MB * 1024 * 1024:
+        logger.info(
+            f"🧹 [Memory Manager] Releasing {idle_bytes / 1024**2:.0f} MB of idle cached VRAM..."
+        )
+        torch.cuda.empty_cache()
+
+
+def warm_up_tts() -> None:
+    """Loads VoxCPM and runs one single-step synthesis to initialise its kernels."""
+    if not TTS_RESIDENT:
+        # The model would be dropped again after the first alert anyway
+        return
+
+    with torch.inference_mode():
+        get_tts_model().generate(text="Xin chào.", inference_timesteps=1)
+
+
+def unload_tts() -> None:
+    """Drops the resident VoxCPM model and releases its VRAM."""
+    global _TTS_MODEL_CACHE
+
+    with _TTS_LOCK:
+        if _TTS_MODEL_CACHE is None:
+            return
+        logger.info("🧹 [Memory Manager] Unloading VoxCPM and freeing up VRAM...")
+        _TTS_MODEL_CACHE = None
+    torch.cuda.empty_cache()
+
+
+# The reasoning LLM evicts VoxCPM through this when VRAM runs short
+register_evictor("VoxCPM", unload_tts)
+
+
+def _inference_timesteps(clinical_note: str) -> int:
+    if len(clinical_note) < SHORT_ALERT_CHARS:
+        return SHORT_ALERT_TIMESTEPS
+    return DEFAULT_TIMESTEPS
+
+
+def _alert_path(
+    clinical_note: str, prompt_wav_path: Optional[str], prompt_text: Optional[str]
+) -> Path:
+    # A re-recorded reference voice at the same path must not reuse old audio
+    prompt_version = ""
+    if prompt_wav_path and os.path.exists(prompt_wav_path):
+        st = os.stat(prompt_wav_path)
+        prompt_version = f"{st.st_mtime_ns}:{st.st_size}"
+
+    key = hashlib.blake2b(
+        "\x00".join(
+            [
+                HF_REPO_ID,
+                clinical_note,
+                prompt_wav_path or "",
+                prompt_version,
+                prompt_text or "",
+                str(CFG_VALUE),
+                str(_inference_timesteps(clinical_note)),
+            ]
+        ).encode("utf-8"),
+        digest_size=16,
+    ).hexdigest()
+    return VOICE_OUT_DIR / f"alert_{key}.wav"
+
+
+def _prune_alert_cache() -> None:
+    alerts = []
+    for alert in VOICE_OUT_DIR.glob("alert_*.wav"):
+        try:
+            alerts.append((alert.stat().st_mtime, alert))
+        except FileNotFoundError:
+            # Another session's prune got there first
+            continue
+    alerts.sort()
+    for _, stale in alerts[:-MAX_CACHED_ALERTS]:
+        stale.unlink(missing_ok=True)
+
 
 @tool
 def generate_clinical_voice_alert(
@@ -27,57 +155,87 @@ def generate_clinical_voice_alert(
 ) -> str:
     """Use this tool to synthesize a voice alert from the clinical reasoning text."""
     current_model = None
+    tmp_file = None
+    output_path = _alert_path(clinical_note, prompt_wav_path, prompt_text)
+    try:
+        # Refresh the mtime so frequently used alerts survive pruning. Unlike
+        # touch(), utime never recreates an alert a concurrent prune removed.
+        os.utime(output_path)
+        logger.info("♻️ [Voice Node] Reusing previously synthesized alert.")
+        return str(output_path)
+    except FileNotFoundError:
+        pass
 
     try:
         logger.info("🎙️ [Voice Node] Initiating local TTS synthesis...")
-        logger.info("🧹 [Memory Manager] Clearing VRAM to prepare for VoxCPM...")
-        torch.cuda.empty_cache()
-
-        logger.info(
-            "📥 [Voice Node] Loading VoxCPM model into GPU. This may take a moment..."
-        )
-        current_model = VoxCPM.from_pretrained(HF_REPO_ID)
+        _release_idle_vram()
+        # Evicts the reasoning LLM first if VoxCPM would not fit beside it
+        current_model = run_with_vram_guard("VoxCPM", get_tts_model)
 
         VOICE_OUT_DIR.mkdir(parents=True, exist_ok=True)
-        output_file = str(VOICE_OUT_DIR / "clinical_alert.wav")
+        output_file = str(output_path)
 
         logger.info(
             f"🔊 [Voice Node] Synthesizing audio for: '{clinical_note[:50]}...'"
         )
 
-        wav = current_model.generate(
-            text=clinical_note,
-            prompt_wav_path=prompt_wav_path if prompt_wav_path else None,
-            prompt_text=prompt_text if prompt_text else None,
-            cfg_value=2.0,
-            inference_timesteps=10,
-            normalize=False,
-            denoise=False,
-            retry_badcase=True,
-            retry_badcase_max_times=3,
-            retry_badcase_ratio_threshold=6.0,
-        )
+        def synthesize():
+            with torch.inference_mode():
+                return current_model.generate(
+                    text=clinical_note,
+                    prompt_wav_path=prompt_wav_path if prompt_wav_path else None,
+                    prompt_text=prompt_text if prompt_text else None,
+                    cfg_value=CFG_VALUE,
+                    inference_timesteps=_inference_timesteps(clinical_note),
+                    normalize=False,
+                    denoise=False,
+                    retry_badcase=True,
+                    retry_badcase_max_times=3,
+                    retry_badcase_ratio_threshold=6.0,
+                )
 
-        sf.write(output_file, wav, current_model.tts_model.sample_rate)
-        logger.info(f"✅ [Voice Node] Alert successfully generated at {output_file}")
+        wav = run_with_vram_guard("VoxCPM", synthesize)
 
-        return output_file
+        # Pin 16-bit PCM so the float samples are never stored as 32-bit float
+        # WAV (twice the bytes for Gradio to copy and serve). Written to a temp
+        # file and renamed so a cache hit never sees a partial alert.
+        tmp_file = f"{output_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        sf.write(
+            tmp_file,
+            wav,
+            current_model.tts_model.sample_rate,
+            format="WAV",
+            subtype="PCM_16",
+        )
+        os.replace(tmp_file, output_file)
+        logger.info(f"✅ [Voice Node] Alert successfully generated at {output_file}")
 
     except Exception as e:
         error_msg = f"LOCAL TTS ERROR: Failed to synthesize speech. Details: {str(e)}"
         logger.error(f"❌ {error_msg}", exc_info=True)
+        if tmp_file:
+            # The prune only sees alert_*.wav, so a stranded temp file would
+            # otherwise stay in the alerts directory forever
+            Path(tmp_file).unlink(missing_ok=True)
         return error_msg
 
     finally:
         # ==========================================================
-        # CRITICAL STEP: Purge the model from VRAM instantly
-        # Guaranteed to run even if model.generate() crashes!
+        # Low-VRAM mode: purge the model instantly, even if
+        # model.generate() crashed
         # ==========================================================
-        logger.info(
-            "🧹 [Memory Manager] Unloading VoxCPM and freeing up VRAM in finally block..."
-        )
-        if current_model is not None:
-            del current_model
         if "wav" in locals():
             del wav
-        torch.cuda.empty_cache()
+        # Drop the local reference too, or unload_tts() frees nothing
+        current_model = None
+        if TTS_RESIDENT:
+            _release_idle_vram()
+        else:
+            unload_tts()
+
+    # Outside the try: a failed cleanup must not turn a good alert into an error
+    try:
+        _prune_alert_cache()
+    except OSError as e:
+        logger.warning(f"⚠️ [Voice Node] Could not prune old alerts: {e}")
+    return output_file
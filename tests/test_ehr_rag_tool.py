@@ -0,0 +1,107 @@
+import sys
+import threading
+import time
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from src.core.embeddings import Fp32NormalizedEmbeddings
+from src.tools import ehr_rag_tool
+
+# =====================================================================
+# RAG SINGLETON TESTS
+# =====================================================================
+
+
+@pytest.fixture
+def cold_vector_db(monkeypatch):
+    """Empties the module singletons and stubs out the heavy constructors."""
+    monkeypatch.setattr(ehr_rag_tool, "_EMBEDDINGS_CACHE", None)
+    monkeypatch.setattr(ehr_rag_tool, "_CHROMA_DB_CACHE", None)
+
+    def slow_load():
+        time.sleep(0.05)
+        return MagicMock()
+
+    load_embeddings = MagicMock(side_effect=slow_load)
+    monkeypatch.setattr(ehr_rag_tool, "_load_query_embeddings", load_embeddings)
+    monkeypatch.setattr(ehr_rag_tool, "Chroma", MagicMock())
+    return load_embeddings
+
+
+def test_concurrent_first_calls_load_the_embedder_once(cold_vector_db):
+    handles = []
+    threads = [
+        threading.Thread(
+            target=lambda: handles.append(ehr_rag_tool.get_vietnamese_vector_db())
+        )
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cold_vector_db.call_count == 1
+    assert len({id(handle) for handle in handles}) == 1
+
+
+def test_batch_search_embeds_all_queries_in_one_pass(monkeypatch):
+    db = MagicMock()
+    db.embeddings.embed_documents.return_value = [[1.0], [2.0]]
+    db.similarity_search_by_vector_with_relevance_scores.side_effect = (
+        lambda vector, k: [(MagicMock(page_content=f"record for {vector[0]}"), 0.1)]
+    )
+    monkeypatch.setattr(ehr_rag_tool, "get_vietnamese_vector_db", lambda: db)
+
+    results = ehr_rag_tool.search_patient_records_batch(["đau đầu", "sốt cao"])
+
+    db.embeddings.embed_documents.assert_called_once_with(["đau đầu", "sốt cao"])
+    db.similarity_search.assert_not_called()
+    assert "record for 1.0" in results[0]
+    assert "record for 2.0" in results[1]
+
+
+def test_half_precision_vectors_are_normalized_in_fp32(monkeypatch):
+    # torch is only needed for inference_mode(); never import the real stack
+    monkeypatch.setitem(sys.modules, "torch", MagicMock())
+    encoder = MagicMock()
+    encoder.encode.side_effect = lambda texts, **kwargs: np.array(
+        [[3.0, 4.0] for _ in texts], dtype=np.float16
+    )
+    embeddings = Fp32NormalizedEmbeddings.model_construct(
+        encode_kwargs={"batch_size": 16}
+    )
+    embeddings._client = encoder
+
+    vectors = embeddings.embed_array(["sốt\ncao", "ho"])
+
+    assert vectors.dtype == np.float32
+    assert vectors.tolist() == [pytest.approx([0.6, 0.8])] * 2
+    assert encoder.encode.call_args.args[0] == ["sốt cao", "ho"]
+    assert encoder.encode.call_args.kwargs["convert_to_numpy"] is True
+    assert embeddings.embed_query("sốt") == pytest.approx([0.6, 0.8])
+
+
+def test_records_below_the_similarity_floor_are_dropped(monkeypatch):
+    db = MagicMock()
+    db._collection.metadata = {"hnsw:space": "cosine"}
+    db.similarity_search_with_score.return_value = [
+        (MagicMock(page_content="close match"), 0.2),
+        (MagicMock(page_content="unrelated record"), 0.9),
+    ]
+    monkeypatch.setattr(ehr_rag_tool, "get_vietnamese_vector_db", lambda: db)
+    monkeypatch.setattr(ehr_rag_tool, "MIN_SIMILARITY", 0.5)
+
+    context = ehr_rag_tool.search_patient_records.invoke({"query": "đau ngực"})
+
+    assert "close match" in context
+    assert "unrelated record" not in context
+
+
+def test_l2_distances_are_mapped_to_cosine_similarity():
+    # Unit vectors at 60 degrees: cos = 0.5, squared L2 = 1.0
+    assert ehr_rag_tool._cosine_similarity(1.0, "l2") == pytest.approx(0.5)
+    assert ehr_rag_tool._cosine_similarity(0.5, "cosine") == pytest.approx(0.5)
+    assert ehr_rag_tool._cosine_similarity(0.5, "ip") == pytest.approx(0.5)
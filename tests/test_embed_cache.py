@@ -0,0 +1,101 @@
+import os
+import pytest
+from collections import Counter, OrderedDict
+from unittest.mock import MagicMock
+
+from src.core import embed_cache
+from src.core.embed_cache import CachedQueryEmbeddings, cached_embed
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    """Points the cache at a temp dir and resets the in-memory fuzzy index."""
+    monkeypatch.setattr(embed_cache, "EMBED_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(embed_cache, "_TEXT_INDEX", OrderedDict())
+    monkeypatch.setattr(embed_cache, "_STATS", Counter())
+
+
+# =====================================================================
+# 1. EXACT CONTENT-HASH CACHE
+# =====================================================================
+def test_cached_embed_reuses_vector_from_disk():
+    embed_fn = MagicMock(return_value=[0.25, 0.5, 0.75])
+
+    first = cached_embed("Đau đầu kéo dài", "mock-model", embed_fn)
+    second = cached_embed("Đau đầu kéo dài", "mock-model", embed_fn)
+
+    assert first == second == [0.25, 0.5, 0.75]
+    embed_fn.assert_called_once()
+
+
+def test_cached_embed_keys_on_model_name():
+    embed_fn = MagicMock(return_value=[1.0])
+
+    cached_embed("Đau đầu kéo dài", "model-a", embed_fn)
+    cached_embed("Đau đầu kéo dài", "model-b", embed_fn)
+
+    assert embed_fn.call_count == 2
+
+
+def test_store_keeps_only_the_most_recent_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(embed_cache, "MAX_CACHED_EMBEDDINGS", 2)
+    embed_fn = MagicMock(return_value=[1.0])
+
+    for i, query in enumerate(["Ho khan", "Sốt cao", "Đau bụng"]):
+        cached_embed(query, "m", embed_fn)
+        # Distinct mtimes, oldest first, independent of filesystem resolution
+        for entry in tmp_path.glob("*.npy"):
+            if entry.stat().st_mtime > 1000:
+                os.utime(entry, (i + 1, i + 1))
+
+    assert len(list(tmp_path.glob("*.npy"))) == 2
+    cached_embed("Sốt cao", "m", embed_fn)
+    cached_embed("Ho khan", "m", embed_fn)
+    assert embed_fn.call_count == 4
+
+
+def test_cached_query_embeddings_passes_documents_through():
+    base = MagicMock()
+    base.embed_documents.return_value = [[1.0], [2.0]]
+    base.embed_query.return_value = [3.0]
+
+    wrapper = CachedQueryEmbeddings(base, "mock-model")
+
+    assert wrapper.embed_documents(["a", "b"]) == [[1.0], [2.0]]
+    assert wrapper.embed_query("q") == [3.0]
+    assert wrapper.embed_query("q") == [3.0]
+    base.embed_query.assert_called_once_with("q")
+
+
+# =====================================================================
+# 2. NEAR-DUPLICATE (FUZZY) REUSE
+# =====================================================================
+def test_fuzzy_reuse_is_off_by_default():
+    embed_fn = MagicMock(side_effect=[[0.1], [0.9]])
+
+    cached_embed("Bệnh nhân sốt 37.5 độ", "m", embed_fn)
+    vector = cached_embed("Bệnh nhân sốt 39.5 độ", "m", embed_fn)
+
+    assert vector == [0.9]
+    assert embed_fn.call_count == 2
+
+
+def test_cached_embed_reuses_near_duplicate_query(monkeypatch):
+    monkeypatch.setattr(embed_cache, "FUZZY_MATCH_THRESHOLD", 0.95)
+    embed_fn = MagicMock(return_value=[0.5, 0.5])
+
+    cached_embed("Bệnh nhân bị đau đầu, buồn nôn và chóng mặt kéo dài.", "m", embed_fn)
+    # One-character typo fix should not trigger a second forward pass
+    vector = cached_embed(
+        "Bệnh nhân bị đau đầu, buồn nôn và chóng mặt kéo dài", "m", embed_fn
+    )
+    # A genuinely different query still goes to the model
+    cached_embed("Kết quả xét nghiệm máu", "m", embed_fn)
+
+    assert vector == [0.5, 0.5]
+    assert embed_fn.call_count == 2
+    assert embed_cache.get_cache_stats() == {
+        "hit_exact": 0,
+        "hit_fuzzy": 1,
+        "miss": 2,
+    }
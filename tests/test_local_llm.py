@@ -0,0 +1,114 @@
+import sys
+import time
+import threading
+from unittest.mock import MagicMock, patch
+
+# Same CI strategy as test_workflow: never import the real CUDA stack
+for module in ["unsloth", "unsloth.models", "torch", "transformers"]:
+    sys.modules.setdefault(module, MagicMock())
+
+import pytest
+
+from src.core import local_llm, vram_manager
+
+
+@pytest.fixture(autouse=True)
+def no_vram_precheck(monkeypatch):
+    """The mocked torch reports no usable VRAM stats; skip the headroom check."""
+    monkeypatch.setattr(vram_manager, "MIN_FREE_VRAM_MB", 0)
+
+
+# =====================================================================
+# DYNAMIC BATCHING TESTS
+# =====================================================================
+
+
+def test_calls_arriving_while_the_gpu_is_busy_share_one_generate(monkeypatch):
+    """Calls queued behind an in-flight generate are decoded together."""
+    monkeypatch.setattr(local_llm, "BATCH_WINDOW_S", 0)
+    batch_sizes = []
+
+    def fake_generate(model_name, conversations):
+        batch_sizes.append(len(conversations))
+        return [conv[-1]["content"].upper() for conv in conversations]
+
+    results = {}
+
+    def call(i):
+        results[i] = local_llm._generate_batched(
+            "mock_model", [{"role": "user", "content": f"case {i}"}]
+        )
+
+    with patch.object(local_llm, "_generate", side_effect=fake_generate):
+        # Hold the GPU as if a previous batch were still decoding
+        with local_llm._GENERATE_LOCK:
+            threads = [threading.Thread(target=call, args=(i,)) for i in range(3)]
+            for thread in threads:
+                thread.start()
+            while len(local_llm._PENDING.get("mock_model", [])) < 3:
+                time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+
+    assert batch_sizes == [3]
+    assert results == {0: "CASE 0", 1: "CASE 1", 2: "CASE 2"}
+
+
+def test_lone_call_skips_the_collection_window(monkeypatch):
+    monkeypatch.setattr(local_llm, "BATCH_WINDOW_S", 5)
+
+    start = time.perf_counter()
+    with patch.object(local_llm, "_generate", return_value=["ok"]):
+        result = local_llm._generate_batched(
+            "mock_model", [{"role": "user", "content": "case"}]
+        )
+
+    assert result == "ok"
+    assert time.perf_counter() - start < 1
+
+
+def test_generation_failure_is_raised_to_every_caller(monkeypatch):
+    monkeypatch.setattr(local_llm, "BATCH_WINDOW_S", 0)
+
+    with patch.object(local_llm, "_generate", side_effect=RuntimeError("CUDA OOM")):
+        result = local_llm.invoke_clinical_reasoning.invoke(
+            {
+                "doctor_query": "q",
+                "rag_context": "r",
+                "ocr_text": "o",
+                "model_name": "mock_model",
+            }
+        )
+
+    assert "CUDA OOM" in result["final_diagnosis"]
+
+
+def test_cuda_oom_evicts_voxcpm_and_retries_once(monkeypatch):
+    monkeypatch.setattr(local_llm, "BATCH_WINDOW_S", 0)
+    unload_tts = MagicMock()
+    monkeypatch.setitem(vram_manager._EVICTORS, "VoxCPM", unload_tts)
+    outcomes = [RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB"), ["ok"]]
+
+    def flaky_generate(model_name, conversations):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    with patch.object(local_llm, "_generate", side_effect=flaky_generate):
+        result = local_llm._generate_batched(
+            "mock_model", [{"role": "user", "content": "case"}]
+        )
+
+    assert result == "ok"
+    unload_tts.assert_called_once()
+
+
+def test_warm_up_runs_a_short_generation_for_the_model():
+    with patch.object(local_llm, "_generate", return_value=[""]) as fake_generate:
+        local_llm.warm_up_llm("mock_model")
+
+    model_name, conversations, max_new_tokens = fake_generate.call_args.args
+    assert model_name == "mock_model"
+    assert len(conversations) == 1
+    assert max_new_tokens < 512
@@ -0,0 +1,61 @@
+import sys
+from unittest.mock import MagicMock
+
+import pytest
+
+# Same CI strategy as test_workflow: never import the real CUDA stack
+sys.modules.setdefault("torch", MagicMock())
+
+from src.core import vram_manager
+
+
+@pytest.fixture
+def evictors(monkeypatch):
+    """Two registered owners whose unload helpers are mocks."""
+    registry = {"reasoning LLM": MagicMock(), "VoxCPM": MagicMock()}
+    monkeypatch.setattr(vram_manager, "_EVICTORS", dict(registry))
+    return registry
+
+
+def _fake_cuda(monkeypatch, free_mb: int) -> MagicMock:
+    cuda = MagicMock()
+    cuda.is_available.return_value = True
+    cuda.mem_get_info.return_value = (free_mb * 1024**2, 16 * 1024**3)
+    cuda.memory_reserved.return_value = 0
+    cuda.memory_allocated.return_value = 0
+    monkeypatch.setattr(vram_manager, "torch", MagicMock(cuda=cuda))
+    return cuda
+
+
+# =====================================================================
+# VRAM PRESSURE EVICTION TESTS
+# =====================================================================
+def test_low_vram_evicts_every_other_model(monkeypatch, evictors):
+    monkeypatch.setattr(vram_manager, "MIN_FREE_VRAM_MB", 2048)
+    _fake_cuda(monkeypatch, free_mb=512)
+
+    assert vram_manager.run_with_vram_guard("VoxCPM", lambda: "wav") == "wav"
+
+    evictors["reasoning LLM"].assert_called_once()
+    evictors["VoxCPM"].assert_not_called()
+
+
+def test_models_stay_resident_while_vram_is_plentiful(monkeypatch, evictors):
+    monkeypatch.setattr(vram_manager, "MIN_FREE_VRAM_MB", 2048)
+    _fake_cuda(monkeypatch, free_mb=8192)
+
+    vram_manager.run_with_vram_guard("VoxCPM", lambda: "wav")
+
+    evictors["reasoning LLM"].assert_not_called()
+
+
+def test_non_oom_errors_propagate_without_eviction(monkeypatch, evictors):
+    monkeypatch.setattr(vram_manager, "MIN_FREE_VRAM_MB", 0)
+    _fake_cuda(monkeypatch, free_mb=8192)
+
+    def broken():
+        raise RuntimeError("shape mismatch")
+
+    with pytest.raises(RuntimeError, match="shape mismatch"):
+        vram_manager.run_with_vram_guard("VoxCPM", broken)
+    evictors["reasoning LLM"].assert_not_called()
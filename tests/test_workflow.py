@@ -1,5 +1,9 @@
+import os
 import sys
+import time
+import threading
 import pytest
+from collections import OrderedDict
 from unittest.mock import MagicMock, patch
 
 # =====================================================================
@@ -25,7 +29,28 @@ for module in mock_modules:
     sys.modules[module] = MagicMock()
 
 # Now it's safe to import your actual code
-from src.main_workflow import omnimed_app, vision_node
+import src.main_workflow as main_workflow
+from src.main_workflow import (
+    build_phi_pattern,
+    omnimed_app,
+    omnimed_app_ephemeral,
+    rag_node,
+    redact_sensitive_info,
+    sanitization_node,
+    vision_node,
+)
+from src.core import vram_manager
+from src.tools import ocr_vision_tool, voice_tts_tool
+
+
+@pytest.fixture(autouse=True)
+def clear_node_caches():
+    """Each test must see its own mocked tools, not cached node results."""
+    main_workflow._RAG_CACHE.clear()
+    main_workflow._SANITIZED_CACHE.clear()
+    yield
+    main_workflow._RAG_CACHE.clear()
+    main_workflow._SANITIZED_CACHE.clear()
 
 
 @pytest.fixture
@@ -60,6 +85,20 @@ def test_vision_node_success(mock_ocr_tool, mock_exists, sample_initial_state):
     assert result["ocr_extracted_text"] == "Mocked receipt text."
 
 
+@patch("src.main_workflow.extract_medical_document_ocr")
+def test_vision_node_missing_file_is_treated_as_no_document(
+    mock_ocr_tool, sample_initial_state
+):
+    """The OCR tool's own stat reports a missing file; no pre-check is made."""
+    mock_ocr_tool.invoke.return_value = (
+        "FILE NOT FOUND: The requested document at 'dummy_path.jpg' does not exist."
+    )
+
+    result = vision_node(sample_initial_state)
+
+    assert result == {"ocr_extracted_text": "No document attached."}
+
+
 # =====================================================================
 # 2. FULL PIPELINE TEST (HITL COMPLIANCE)
 # =====================================================================
@@ -95,3 +134,361 @@ def test_full_langgraph_pipeline_execution(
     # Execution halts at Human-in-the-Loop node; verify initial output
     assert result is not None
     assert "ocr_extracted_text" in result
+    mock_voice.invoke.assert_not_called()
+
+
+# =====================================================================
+# 3. AUTO-APPROVED FAST PATH (NO HITL PAUSE)
+# =====================================================================
+@patch("os.path.exists")
+@patch("src.main_workflow.extract_medical_document_ocr")
+@patch("src.main_workflow.search_patient_records")
+@patch("src.main_workflow.invoke_clinical_reasoning")
+@patch("src.main_workflow.generate_clinical_voice_alert")
+def test_non_interactive_run_completes_in_single_invoke(
+    mock_voice, mock_reasoning, mock_rag, mock_ocr, mock_exists, sample_initial_state
+):
+    """
+    Tests that a non-interactive (auto-approved) case skips the Doctor
+    Approval interrupt and reaches the Voice node in one invocation.
+    """
+    mock_exists.return_value = True
+    mock_ocr.invoke.return_value = "Mocked OCR text"
+    mock_rag.invoke.return_value = "Mocked RAG Context"
+    mock_reasoning.invoke.return_value = {
+        "final_diagnosis": "Mocked Diagnosis",
+        "voice_summary": "Mocked Voice",
+    }
+    mock_voice.invoke.return_value = "audio.wav"
+
+    state = {**sample_initial_state, "interactive": False}
+    thread_config = {"configurable": {"thread_id": "ci_auto_approve_thread"}}
+
+    result = omnimed_app.invoke(state, config=thread_config)
+
+    assert result["final_diagnosis"] == "Mocked Diagnosis"
+    assert result["voice_alert_path"] == "audio.wav"
+
+    # The checkpointer-less graph needs no thread configuration at all
+    ephemeral_result = omnimed_app_ephemeral.invoke(state)
+    assert ephemeral_result["voice_alert_path"] == "audio.wav"
+
+
+# =====================================================================
+# 4. PARALLEL OCR / RAG FAN-OUT
+# =====================================================================
+@patch("os.path.exists")
+@patch("src.main_workflow.extract_medical_document_ocr")
+@patch("src.main_workflow.search_patient_records")
+@patch("src.main_workflow.invoke_clinical_reasoning")
+@patch("src.main_workflow.generate_clinical_voice_alert")
+def test_reasoning_runs_once_after_both_branches_join(
+    mock_voice, mock_reasoning, mock_rag, mock_ocr, mock_exists, sample_initial_state
+):
+    """
+    Tests that the parallel OCR and RAG branches join before reasoning, so
+    the LLM is called exactly once with both sanitized text and RAG context.
+    """
+    mock_exists.return_value = True
+    mock_ocr.invoke.return_value = "Bệnh nhân: Nguyen Van A"
+    mock_rag.invoke.return_value = "Mocked RAG Context"
+    mock_reasoning.invoke.return_value = {
+        "final_diagnosis": "Mocked Diagnosis",
+        "voice_summary": "Mocked Voice",
+    }
+    mock_voice.invoke.return_value = "audio.wav"
+
+    omnimed_app_ephemeral.invoke({**sample_initial_state, "interactive": False})
+
+    mock_reasoning.invoke.assert_called_once()
+    llm_inputs = mock_reasoning.invoke.call_args.args[0]
+    assert llm_inputs["rag_context"] == "Mocked RAG Context"
+    assert llm_inputs["ocr_text"] == "Bệnh nhân: [REDACTED_NAME]"
+
+
+# =====================================================================
+# 5. PHI REDACTION
+# =====================================================================
+def test_redaction_masks_phone_numbers_and_labelled_names():
+    text = "Họ và tên: Nguyễn Văn An 0912345678\nChẩn đoán: viêm họng"
+
+    redacted = redact_sensitive_info(text)
+
+    assert redacted == (
+        "Họ và tên: [REDACTED_NAME][REDACTED_PHONE]\nChẩn đoán: viêm họng"
+    )
+
+
+def test_redaction_masks_configured_phi_terms(monkeypatch):
+    monkeypatch.setattr(
+        main_workflow, "_RE_PHI", build_phi_pattern(["BV Chợ Rẫy", "BS. Hoa"])
+    )
+
+    redacted = redact_sensitive_info("Khám tại BV Chợ Rẫy bởi BS. Hoa, BS. Hoang")
+
+    assert redacted == "Khám tại [REDACTED_TERM] bởi [REDACTED_TERM], BS. Hoang"
+
+
+def test_sanitization_is_memoized_per_document_content():
+    state = {"ocr_extracted_text": "Tên bệnh nhân: Lê Văn C, SĐT 0987654321"}
+
+    with patch(
+        "src.main_workflow.redact_sensitive_info", wraps=redact_sensitive_info
+    ) as spy:
+        first = sanitization_node(state)
+        second = sanitization_node(state)
+
+    assert first == second
+    spy.assert_called_once()
+
+
+def test_sanitization_drops_the_unredacted_ocr_text():
+    result = sanitization_node({"ocr_extracted_text": "Bệnh nhân: Trần Thị B"})
+
+    assert result == {
+        "sanitized_text": "Bệnh nhân: [REDACTED_NAME]",
+        "ocr_extracted_text": None,
+    }
+
+
+# =====================================================================
+# 6. RAG RESULT CACHE
+# =====================================================================
+@patch("src.main_workflow.search_patient_records")
+def test_rag_node_reuses_context_for_repeated_queries(mock_rag):
+    mock_rag.invoke.return_value = "Mocked RAG Context"
+
+    first = rag_node({"doctor_query": "Tóm tắt  đơn thuốc"})
+    second = rag_node({"doctor_query": "tóm tắt đơn thuốc "})
+
+    assert first == second == {"rag_clinical_context": "Mocked RAG Context"}
+    mock_rag.invoke.assert_called_once()
+
+
+@patch("src.main_workflow.search_patient_records")
+def test_rag_node_bypasses_cache_for_patient_specific_queries(mock_rag):
+    mock_rag.invoke.return_value = "Mocked RAG Context"
+    state = {"doctor_query": "History of BN_001", "patient_id": "BN_001"}
+
+    rag_node(state)
+    rag_node(state)
+
+    assert mock_rag.invoke.call_count == 2
+
+
+# =====================================================================
+# 7. TOOL OUTPUT NORMALIZATION
+# =====================================================================
+@patch("src.main_workflow.search_patient_records")
+def test_structured_tool_results_reach_the_llm_as_json(mock_rag):
+    mock_rag.invoke.return_value = {"output": {"bệnh": "cúm", "k": 3}}
+
+    result = rag_node({"doctor_query": "Structured context"})
+
+    assert result["rag_clinical_context"] == '{"bệnh": "cúm", "k": 3}'
+
+
+@pytest.fixture
+def fake_voxcpm(monkeypatch, tmp_path):
+    """Resident-mode TTS tool with VoxCPM, soundfile and VRAM stats faked."""
+    fake_voxcpm = MagicMock()
+    monkeypatch.setattr(voice_tts_tool, "VoxCPM", fake_voxcpm)
+    monkeypatch.setattr(voice_tts_tool, "_TTS_MODEL_CACHE", None)
+    monkeypatch.setattr(voice_tts_tool, "TTS_RESIDENT", True)
+    monkeypatch.setattr(voice_tts_tool, "VOICE_OUT_DIR", tmp_path)
+    fake_sf = MagicMock()
+    fake_sf.write.side_effect = lambda path, *args, **kwargs: open(path, "wb").close()
+    monkeypatch.setattr(voice_tts_tool, "sf", fake_sf)
+
+    cuda = voice_tts_tool.torch.cuda
+    monkeypatch.setattr(cuda, "is_available", lambda: True)
+    monkeypatch.setattr(cuda, "memory_reserved", lambda: 0)
+    monkeypatch.setattr(cuda, "memory_allocated", lambda: 0)
+    monkeypatch.setattr(cuda, "empty_cache", MagicMock())
+    monkeypatch.setattr(vram_manager, "MIN_FREE_VRAM_MB", 0)
+    return fake_voxcpm
+
+
+def test_tts_model_is_loaded_once_across_alerts(fake_voxcpm):
+    """VoxCPM stays resident, so a second alert skips the model load."""
+    for note in ("Cảnh báo thứ nhất", "Cảnh báo thứ hai"):
+        voice_tts_tool.generate_clinical_voice_alert.invoke({"clinical_note": note})
+
+    assert fake_voxcpm.from_pretrained.call_count == 1
+    timesteps = [
+        call.kwargs["inference_timesteps"]
+        for call in fake_voxcpm.from_pretrained.return_value.generate.call_args_list
+    ]
+    assert timesteps == [voice_tts_tool.SHORT_ALERT_TIMESTEPS] * 2
+
+    voice_tts_tool.unload_tts()
+    assert voice_tts_tool._TTS_MODEL_CACHE is None
+
+
+def test_document_converter_is_built_once_under_concurrency(monkeypatch):
+    def slow_build():
+        time.sleep(0.05)
+        return MagicMock()
+
+    build = MagicMock(side_effect=slow_build)
+    monkeypatch.setattr(ocr_vision_tool, "_DOC_CONVERTER_CACHE", None)
+    monkeypatch.setattr(ocr_vision_tool, "_build_document_converter", build)
+
+    threads = [
+        threading.Thread(target=ocr_vision_tool.get_document_converter)
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert build.call_count == 1
+
+
+def _fake_pdfium(page_texts):
+    pdf = MagicMock()
+    pdf.__len__.return_value = len(page_texts)
+    pdf.__getitem__.side_effect = lambda i: MagicMock(
+        **{"get_textpage.return_value.get_text_range.return_value": page_texts[i]}
+    )
+    return MagicMock(PdfDocument=MagicMock(return_value=pdf))
+
+
+def test_digital_pdf_skips_docling(monkeypatch):
+    page_text = "Kết quả xét nghiệm máu. " * 20
+    monkeypatch.setitem(sys.modules, "pypdfium2", _fake_pdfium([page_text] * 2))
+    build = MagicMock()
+    monkeypatch.setattr(ocr_vision_tool, "get_document_converter", build)
+
+    output = ocr_vision_tool._convert_document("/tmp/ket_qua.pdf")
+
+    build.assert_not_called()
+    assert "--- START OF SCANNED DOCUMENT (ket_qua.pdf) ---" in output
+    assert output.count("Kết quả xét nghiệm máu.") == 40
+
+
+def test_pdf_with_scanned_later_pages_goes_through_docling(monkeypatch):
+    page_text = "Kết quả xét nghiệm máu. " * 20
+    monkeypatch.setitem(
+        sys.modules, "pypdfium2", _fake_pdfium([page_text] * 3 + ["", page_text])
+    )
+    converter = MagicMock()
+    converter.convert.return_value.document.export_to_markdown.return_value = "OCR"
+    monkeypatch.setattr(ocr_vision_tool, "get_document_converter", lambda: converter)
+
+    output = ocr_vision_tool._convert_document("/tmp/mixed.pdf")
+
+    converter.convert.assert_called_once_with("/tmp/mixed.pdf")
+    assert "OCR" in output
+
+
+def test_scanned_pdf_still_goes_through_docling(monkeypatch):
+    monkeypatch.setitem(sys.modules, "pypdfium2", _fake_pdfium(["", ""]))
+    converter = MagicMock()
+    converter.convert.return_value.document.export_to_markdown.return_value = "OCR"
+    monkeypatch.setattr(ocr_vision_tool, "get_document_converter", lambda: converter)
+
+    output = ocr_vision_tool._convert_document("/tmp/scan.pdf")
+
+    converter.convert.assert_called_once_with("/tmp/scan.pdf")
+    assert "OCR" in output
+
+
+def test_oversized_document_is_rejected_before_docling(monkeypatch, tmp_path):
+    scan = tmp_path / "scan.pdf"
+    scan.write_bytes(b"%PDF" + b"0" * 2048)
+    monkeypatch.setattr(ocr_vision_tool, "MAX_DOCUMENT_BYTES", 1024)
+    build = MagicMock()
+    monkeypatch.setattr(ocr_vision_tool, "get_document_converter", build)
+
+    output = ocr_vision_tool.extract_medical_document_ocr.invoke(
+        {"file_path": str(scan)}
+    )
+
+    build.assert_not_called()
+    assert output.startswith("DOCUMENT TOO LARGE")
+
+
+def test_repeated_alert_text_is_served_from_disk(fake_voxcpm):
+    paths = [
+        voice_tts_tool.generate_clinical_voice_alert.invoke({"clinical_note": note})
+        for note in ("Cảnh báo tương tác thuốc", "Cảnh báo tương tác thuốc", "Khác")
+    ]
+
+    generate = fake_voxcpm.from_pretrained.return_value.generate
+    assert generate.call_count == 2
+    assert paths[0] == paths[1] != paths[2]
+
+
+def test_cached_vram_is_kept_unless_mostly_idle(fake_voxcpm, monkeypatch):
+    cuda = voice_tts_tool.torch.cuda
+
+    voice_tts_tool.generate_clinical_voice_alert.invoke({"clinical_note": "Ngắn"})
+    cuda.empty_cache.assert_not_called()
+
+    monkeypatch.setattr(cuda, "memory_reserved", lambda: 4 * 1024**3)
+    voice_tts_tool._release_idle_vram()
+    cuda.empty_cache.assert_called_once()
+
+
+def test_low_vram_mode_unloads_voxcpm_after_each_alert(fake_voxcpm, monkeypatch):
+    monkeypatch.setattr(voice_tts_tool, "TTS_RESIDENT", False)
+
+    for note in ("Cảnh báo thứ nhất", "Cảnh báo thứ hai"):
+        voice_tts_tool.generate_clinical_voice_alert.invoke({"clinical_note": note})
+
+    assert fake_voxcpm.from_pretrained.call_count == 2
+    assert voice_tts_tool._TTS_MODEL_CACHE is None
+
+
+def test_failed_alert_write_leaves_no_temp_file(fake_voxcpm, tmp_path):
+    def partial_write(path, *args, **kwargs):
+        open(path, "wb").close()
+        raise RuntimeError("disk full")
+
+    voice_tts_tool.sf.write.side_effect = partial_write
+
+    result = voice_tts_tool.generate_clinical_voice_alert.invoke(
+        {"clinical_note": "Cảnh báo"}
+    )
+
+    assert result.startswith("LOCAL TTS ERROR")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_evicted_prefetches_are_cancelled(monkeypatch, tmp_path):
+    monkeypatch.setattr(ocr_vision_tool, "MAX_PENDING_PREFETCHES", 1)
+    monkeypatch.setattr(ocr_vision_tool, "_PREFETCHED", OrderedDict())
+    futures = []
+
+    def submit(fn, path):
+        futures.append(MagicMock())
+        return futures[-1]
+
+    monkeypatch.setattr(ocr_vision_tool._OCR_EXECUTOR, "submit", submit)
+    for name in ("a.jpg", "b.jpg"):
+        (tmp_path / name).write_bytes(b"img")
+        ocr_vision_tool.prefetch_document_ocr(str(tmp_path / name))
+
+    futures[0].cancel.assert_called_once()
+    futures[1].cancel.assert_not_called()
+
+
+def test_alert_prune_tolerates_files_removed_concurrently(monkeypatch, tmp_path):
+    monkeypatch.setattr(voice_tts_tool, "VOICE_OUT_DIR", tmp_path)
+    monkeypatch.setattr(voice_tts_tool, "MAX_CACHED_ALERTS", 1)
+    for i, name in enumerate(("alert_old.wav", "alert_new.wav")):
+        (tmp_path / name).write_bytes(b"RIFF")
+        os.utime(tmp_path / name, (i, i))
+    vanished = tmp_path / "alert_gone.wav"
+    real_glob = type(tmp_path).glob
+    monkeypatch.setattr(
+        type(tmp_path),
+        "glob",
+        lambda self, pattern: [vanished, *real_glob(self, pattern)],
+    )
+
+    voice_tts_tool._prune_alert_cache()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["alert_new.wav"]